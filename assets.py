@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+import brotli
+from jinja2 import Environment, FileSystemLoader
+from starlette.requests import Request
+from starlette.responses import Response
+
+# 只压缩文本类资源，图片等已压缩格式直接返回原始内容
+COMPRESSIBLE_TYPES = ("text/", "image/svg+xml", "application/javascript", "application/json")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STATIC_CACHE_CONTROL = "public, max-age=3600"
+INDEX_CACHE_CONTROL = "no-cache"
+
+STATIC_URL_PATTERN = re.compile(r"/static/([\w.-]+)")
+
+
+class Asset:
+    """预先压缩好的静态资源，按请求的 Accept-Encoding 返回对应版本"""
+    __slots__ = ("content_type", "digest", "etag", "variants")
+
+    def __init__(self, content: bytes, content_type: str):
+        self.content_type = content_type
+        self.digest = hashlib.sha256(content).hexdigest()
+        # 不同压缩版本内容等价，使用弱 ETag
+        self.etag = f'W/"{self.digest[:16]}"'
+        self.variants: Dict[str, bytes] = {"identity": content}
+        if content_type.startswith(COMPRESSIBLE_TYPES):
+            for encoding, compressed in (
+                ("br", brotli.compress(content, quality=11)),
+                ("gzip", gzip.compress(content, compresslevel=9, mtime=0)),
+            ):
+                if len(compressed) < len(content):
+                    self.variants[encoding] = compressed
+
+    def _choose_encoding(self, accept_encoding: str) -> str:
+        accepted = set()
+        for item in accept_encoding.split(","):
+            coding, _, params = item.partition(";")
+            name, _, value = params.strip().partition("=")
+            try:
+                quality = float(value) if name.strip() == "q" else 1.0
+            except ValueError:
+                quality = 1.0
+            if quality > 0:
+                accepted.add(coding.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+    def response(self, request: Request, cache_control: str) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if self.etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+        encoding = self._choose_encoding(request.headers.get("accept-encoding", ""))
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], headers=headers, media_type=self.content_type)
+
+
+class AssetStore:
+    """
+    启动时加载 static 目录下的资源并生成带内容哈希的文件名，
+    同时渲染首页模板，将其中的 /static/ 链接替换为带哈希的地址
+    """
+
+    def __init__(self, static_dir: str, template_dir: str, index_template: str):
+        self._static: Dict[str, Asset] = {}
+        self._hashed: Dict[str, Asset] = {}
+        self._urls: Dict[str, str] = {}
+        for file_name in sorted(os.listdir(static_dir)):
+            path = os.path.join(static_dir, file_name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, "rb") as f:
+                content = f.read()
+            content_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+            asset = Asset(content, content_type)
+            stem, ext = os.path.splitext(file_name)
+            hashed_name = f"{stem}.{asset.digest[:10]}{ext}"
+            self._static[file_name] = asset
+            self._hashed[hashed_name] = asset
+            self._urls[file_name] = f"/static/{hashed_name}"
+
+        env = Environment(loader=FileSystemLoader(template_dir), autoescape=True)
+        html = env.get_template(index_template).render()
+        html = STATIC_URL_PATTERN.sub(lambda m: self._urls.get(m.group(1), m.group(0)), html)
+        self.index = Asset(html.encode("utf-8"), "text/html; charset=utf-8")
+
+    def get_static(self, file_name: str) -> Tuple[Optional[Asset], str]:
+        """
+        查找静态文件
+        :return: (资源, Cache-Control)；带哈希的文件名内容不会变化，可长期缓存
+        """
+        if asset := self._hashed.get(file_name):
+            return asset, IMMUTABLE_CACHE_CONTROL
+        return self._static.get(file_name), STATIC_CACHE_CONTROL
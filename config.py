@@ -2,9 +2,13 @@ import os
 
 import toml
 
+# 可通过环境变量指定配置文件，默认为项目目录下的 config.toml
+CONFIG_PATH = os.environ.get("REALTIMEBUS_CONFIG", os.path.join(os.path.dirname(__file__), "config.toml"))
+
+
 class Config:
     def __init__(self):
-        self.config = toml.load(os.path.join(os.path.dirname(__file__), "config.toml"))
+        self.config = toml.load(CONFIG_PATH)
 
     def get(self, section, key=None, default=None):
         section_data = self.config.get(section, {})
@@ -13,6 +17,6 @@ class Config:
         return section_data
 
     def refresh(self):
-        self.config = toml.load(os.path.join(os.path.dirname(__file__), "config.toml"))
+        self.config = toml.load(CONFIG_PATH)
 
 config = Config()
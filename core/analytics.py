@@ -0,0 +1,325 @@
+"""
+线路到站可靠性统计
+
+每次刷新线路实时数据时检测车辆到达目标站点的时间，按天、按小时增量更新车头时距（headway）分布、
+串车次数和与时间表的吻合情况。查询只合并预先计算好的每日汇总，不会重新扫描原始数据。
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.api import LineDetail
+
+logger = logging.getLogger(__name__)
+
+HOURS = 24
+# 车头时距直方图：每格 60 秒，共 60 格，最后一格包含 59 分钟以上
+HEADWAY_BIN_SECONDS = 60
+HEADWAY_BINS = 60
+# 单次查询最多包含的天数
+MAX_QUERY_DAYS = 31
+
+
+def parse_scheduled_headways(timetable: Optional[list]) -> np.ndarray:
+    """
+    根据时间表计算每小时的平均计划发车间隔（秒）
+    :param timetable: get_dep_time 返回的时间表，[{"fTime", "eTime", "times": ["06:00", ...]}, ...]
+    :return: 长度为 24 的数组，没有计划班次的小时为 nan
+    """
+    scheduled = np.full(HOURS, np.nan)
+    if not timetable:
+        return scheduled
+    minutes = []
+    for time_range in timetable:
+        for value in time_range.get("times", []):
+            try:
+                hour, minute = value.split(":")[:2]
+                minutes.append(int(hour) * 60 + int(minute))
+            except ValueError:
+                continue
+    if len(minutes) < 2:
+        return scheduled
+    minutes = np.unique(np.array(minutes))
+    gaps = np.diff(minutes) * 60.0
+    hours = (minutes[1:] // 60) % HOURS
+    counts = np.bincount(hours, minlength=HOURS)
+    totals = np.bincount(hours, weights=gaps, minlength=HOURS)
+    np.divide(totals, counts, out=scheduled, where=counts > 0)
+    return scheduled
+
+
+class DailyAggregate:
+    """单条线路在某一天的按小时汇总数据"""
+    __slots__ = ("histogram", "headway_sum", "headway_sq_sum", "bunching", "adherent",
+                 "scheduled_count", "scheduled", "last_arrival")
+
+    def __init__(self, scheduled: Optional[np.ndarray] = None):
+        self.histogram = np.zeros((HOURS, HEADWAY_BINS), dtype=np.int64)
+        self.headway_sum = np.zeros(HOURS)
+        self.headway_sq_sum = np.zeros(HOURS)
+        self.bunching = np.zeros(HOURS, dtype=np.int64)
+        self.adherent = np.zeros(HOURS, dtype=np.int64)
+        # 有计划间隔可以比较的车头时距数量
+        self.scheduled_count = np.zeros(HOURS, dtype=np.int64)
+        self.scheduled = np.full(HOURS, np.nan) if scheduled is None else scheduled
+        self.last_arrival = np.nan
+
+    def add_arrivals(self, arrivals: np.ndarray, previous: float, max_headway: float,
+                     bunching_ratio: float, bunching_seconds: float, tolerance: float):
+        """
+        批量加入到站时间并更新汇总
+        :param arrivals: 升序排列的到站时间戳
+        :param previous: 上一次到站时间，没有时为 nan
+        :param max_headway: 超过该秒数的间隔视为停运或漏检，不计入统计
+        :param bunching_ratio: 间隔小于计划间隔的该比例时视为串车
+        :param bunching_seconds: 没有计划间隔时，间隔小于该秒数视为串车
+        :param tolerance: 间隔与计划间隔相差在该比例以内视为准点
+        """
+        if len(arrivals) == 0:
+            return
+        times = np.concatenate(([previous], arrivals))
+        headways = np.diff(times)
+        later = times[1:]
+        valid = ~np.isnan(headways) & (headways > 0) & (headways <= max_headway)
+        headways, later = headways[valid], later[valid]
+        self.last_arrival = float(arrivals[-1])
+        if len(headways) == 0:
+            return
+
+        utc_offset = time.localtime(float(later[0])).tm_gmtoff
+        hours = ((later + utc_offset) // 3600 % HOURS).astype(np.int64)
+        bins = np.minimum(headways // HEADWAY_BIN_SECONDS, HEADWAY_BINS - 1).astype(np.int64)
+        np.add.at(self.histogram, (hours, bins), 1)
+        np.add.at(self.headway_sum, hours, headways)
+        np.add.at(self.headway_sq_sum, hours, headways ** 2)
+
+        scheduled = self.scheduled[hours]
+        known = ~np.isnan(scheduled)
+        threshold = np.where(known, scheduled * bunching_ratio, bunching_seconds)
+        np.add.at(self.bunching, hours, headways < threshold)
+        with np.errstate(invalid="ignore"):
+            adherent = known & (np.abs(headways - scheduled) <= tolerance * scheduled)
+        np.add.at(self.adherent, hours, adherent)
+        np.add.at(self.scheduled_count, hours, known)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """复制当前数据，用于在其他线程中保存"""
+        return {name: np.copy(getattr(self, name)) for name in self.__slots__}
+
+    @staticmethod
+    def save_arrays(path: str, arrays: Dict[str, np.ndarray]):
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "DailyAggregate":
+        aggregate = cls()
+        with np.load(path) as data:
+            for name in cls.__slots__:
+                value = data[name]
+                setattr(aggregate, name, float(value) if value.ndim == 0 else value)
+        return aggregate
+
+
+def summarize(aggregates: List[DailyAggregate]) -> List[Dict]:
+    """
+    合并多天的汇总数据，计算每小时的统计指标
+    :return: 只包含有数据的小时
+    """
+    if not aggregates:
+        return []
+    histogram = np.sum([a.histogram for a in aggregates], axis=0)
+    headway_sum = np.sum([a.headway_sum for a in aggregates], axis=0)
+    headway_sq_sum = np.sum([a.headway_sq_sum for a in aggregates], axis=0)
+    bunching = np.sum([a.bunching for a in aggregates], axis=0)
+    adherent = np.sum([a.adherent for a in aggregates], axis=0)
+    scheduled_count = np.sum([a.scheduled_count for a in aggregates], axis=0)
+    scheduled_all = np.array([a.scheduled for a in aggregates])
+    has_schedule = ~np.isnan(scheduled_all).all(axis=0)
+
+    count = histogram.sum(axis=1)
+    hours = np.nonzero(count)[0]
+    if len(hours) == 0:
+        return []
+    count = count[hours]
+    mean = headway_sum[hours] / count
+    std = np.sqrt(np.maximum(headway_sq_sum[hours] / count - mean ** 2, 0))
+    cumulative = histogram[hours].cumsum(axis=1)
+
+    def percentile(q: float) -> np.ndarray:
+        index = (cumulative < q * count[:, None]).sum(axis=1)
+        return (index + 0.5) * HEADWAY_BIN_SECONDS
+
+    p50, p90 = percentile(0.5), percentile(0.9)
+    scheduled = np.full(len(hours), np.nan)
+    scheduled[has_schedule[hours]] = np.nanmean(scheduled_all[:, hours[has_schedule[hours]]], axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        adherence = adherent[hours] / scheduled_count[hours]
+
+    def optional(value: float) -> Optional[float]:
+        return None if np.isnan(value) else round(float(value), 3)
+
+    return [
+        {
+            "hour": int(hour),
+            "headway_count": int(count[i]),
+            "headway_mean": round(float(mean[i]), 1),
+            "headway_std": round(float(std[i]), 1),
+            "headway_p50": float(p50[i]),
+            "headway_p90": float(p90[i]),
+            "headway_cv": round(float(std[i] / mean[i]), 3) if mean[i] else None,
+            "bunching_events": int(bunching[hour]),
+            "bunching_rate": round(float(bunching[hour] / count[i]), 3),
+            "scheduled_headway": optional(scheduled[i]),
+            "schedule_adherence": optional(adherence[i]),
+        }
+        for i, hour in enumerate(hours)
+    ]
+
+
+class ArrivalAnalytics:
+    """检测车辆到站并维护每日汇总"""
+
+    def __init__(self, directory: str, max_headway: float = 3 * 60 * 60, bunching_ratio: float = 0.25,
+                 bunching_seconds: float = 120, tolerance: float = 0.5, max_days: int = MAX_QUERY_DAYS,
+                 max_gap: float = 60):
+        """
+        :param max_gap: 相邻两次观测间隔超过该秒数时不检测到站，避免长时间无人查询后把中间时刻误记为到站时间
+        """
+        self.directory = directory
+        self.max_headway = max_headway
+        self.bunching_ratio = bunching_ratio
+        self.bunching_seconds = bunching_seconds
+        self.tolerance = tolerance
+        self.max_days = max_days
+        self.max_gap = max_gap
+        os.makedirs(directory, exist_ok=True)
+        # line_key -> (上次观测时间, {即将到达目标站点的 bus_id: 最后一次看到的时间})
+        self._approaching: Dict[str, Tuple[float, Dict[str, float]]] = {}
+        self._today: Dict[str, Tuple[date, DailyAggregate]] = {}
+        # line_key -> 写锁文件描述符，进程退出时自动释放
+        self._writer_locks: Dict[str, int] = {}
+        # 同一线路的读写按顺序执行，避免较早的数据覆盖较新的文件
+        self._record_locks: Dict[str, asyncio.Lock] = {}
+
+    def _path(self, line_key: str, day: date) -> str:
+        return os.path.join(self.directory, line_key, f"{day.isoformat()}.npz")
+
+    def acquire_writer(self, line_key: str) -> bool:
+        """
+        尝试成为该线路统计数据的唯一写入进程
+        多个 worker 或轮询进程刷新同一线路时，只有持有文件锁的进程记录到站，避免互相覆盖汇总文件
+        """
+        if line_key in self._writer_locks:
+            return True
+        line_dir = os.path.join(self.directory, line_key)
+        os.makedirs(line_dir, exist_ok=True)
+        fd = os.open(os.path.join(line_dir, ".writer.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._writer_locks[line_key] = fd
+        return True
+
+    def detect_arrivals(self, line_key: str, target_order: int, detail: LineDetail) -> List[float]:
+        """
+        比较相邻两次观测，下一站为目标站点的车辆从列表中消失即视为已到站
+        到站时间取最后一次看到与本次观测的中间时刻，两次观测间隔超过 max_gap 时无法确定到站时间，不计入
+        """
+        observed_at = detail.fetched_at
+        last_observed, approaching = self._approaching.get(line_key, (0.0, {}))
+        if observed_at <= last_observed:
+            return []
+        present = {bus.bus_id for bus in detail.buses}
+        arrivals = []
+        if observed_at - last_observed <= self.max_gap:
+            arrivals = sorted((seen_at + observed_at) / 2 for bus_id, seen_at in approaching.items()
+                              if bus_id not in present)
+        self._approaching[line_key] = (observed_at, {
+            bus.bus_id: observed_at for bus in detail.buses if bus.order == target_order
+        })
+        return arrivals
+
+    def needs_schedule(self, line_key: str) -> bool:
+        """当天的汇总尚未创建，需要传入时间表"""
+        today = self._today.get(line_key)
+        return today is None or today[0] != date.today()
+
+    def _get_today(self, line_key: str, timetable: Optional[list]) -> Tuple[DailyAggregate, float]:
+        """获取当天的汇总，以及上一次到站时间（可能在前一天），可能读取文件，需在线程中调用"""
+        today = date.today()
+        cached = self._today.get(line_key)
+        previous = np.nan
+        if cached and cached[0] == today:
+            return cached[1], cached[1].last_arrival
+        if cached:
+            previous = cached[1].last_arrival
+        path = self._path(line_key, today)
+        if os.path.exists(path):
+            aggregate = DailyAggregate.load(path)
+            previous = aggregate.last_arrival
+        else:
+            aggregate = DailyAggregate(parse_scheduled_headways(timetable))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._today[line_key] = (today, aggregate)
+        return aggregate, previous
+
+    async def record(self, line_key: str, arrivals: List[float], timetable: Optional[list] = None):
+        """
+        将 detect_arrivals 检测到的到站时间计入当天汇总，文件读写在线程中执行
+        :param line_key: 线路标识，与 line_real_key 一致
+        :param timetable: 线路时间表，仅在 needs_schedule 为 True 时需要
+        """
+        if not arrivals:
+            return
+        lock = self._record_locks.setdefault(line_key, asyncio.Lock())
+        async with lock:
+            if self.needs_schedule(line_key):
+                aggregate, previous = await asyncio.to_thread(self._get_today, line_key, timetable)
+            else:
+                aggregate, previous = self._get_today(line_key, timetable)
+            aggregate.add_arrivals(np.array(arrivals), previous, self.max_headway,
+                                   self.bunching_ratio, self.bunching_seconds, self.tolerance)
+            await asyncio.to_thread(DailyAggregate.save_arrays, self._path(line_key, date.today()),
+                                    aggregate.to_arrays())
+
+    async def query(self, line_key: str, start: date, end: date) -> List[Dict]:
+        """
+        查询日期范围内（含首尾）的每小时统计，文件读取和计算在线程中执行
+        :raises ValueError: end 早于 start 或范围超过 max_days 天
+        """
+        if end < start:
+            raise ValueError(f"end {end} is earlier than start {start}")
+        if (end - start).days + 1 > self.max_days:
+            raise ValueError(f"date range exceeds {self.max_days} days")
+        return await asyncio.to_thread(self._query, line_key, start, end)
+
+    def _query(self, line_key: str, start: date, end: date) -> List[Dict]:
+        aggregates = []
+        day = start
+        while day <= end:
+            path = self._path(line_key, day)
+            if os.path.exists(path):
+                aggregates.append(DailyAggregate.load(path))
+            day += timedelta(days=1)
+        return summarize(aggregates)
+
+    async def days(self, line_key: str) -> List[str]:
+        """有统计数据的日期"""
+        return await asyncio.to_thread(self._days, line_key)
+
+    def _days(self, line_key: str) -> List[str]:
+        line_dir = os.path.join(self.directory, line_key)
+        if not os.path.isdir(line_dir):
+            return []
+        return sorted(name[:-len(".npz")] for name in os.listdir(line_dir)
+                      if name.endswith(".npz") and not name.endswith(".tmp.npz"))
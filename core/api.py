@@ -1,17 +1,191 @@
 import logging
-from typing import Optional
+import time
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional
 
-import json
 import aiohttp
+import orjson
 
 from config import config
 from core.exceptions import BusApiRequestError, BusApiResponseError
 
 logger = logging.getLogger(__name__)
 
+# 响应中包裹 JSON 的特殊标记
+RESPONSE_PREFIX = b"YGKJ##"
+RESPONSE_SUFFIX = b"**YGKJ"
+# optArrivalTime 为毫秒时间戳，超出该范围时无法格式化
+MAX_ARRIVAL_TIME_MS = 253402300799000
+
+
+class Bus:
+    """单辆公交车的实时信息，只保留查询需要的字段"""
+    __slots__ = ("bus_id", "order", "distance_to_sc", "distance_to_wait_stn",
+                 "delay", "delay_desc", "opt_arrival_time", "optimistic_time")
+
+    def __init__(self, bus_id: str, order: int, distance_to_sc: int, distance_to_wait_stn: int,
+                 delay: int, delay_desc: str, opt_arrival_time: int, optimistic_time: int):
+        self.bus_id = bus_id
+        self.order = order
+        self.distance_to_sc = distance_to_sc
+        self.distance_to_wait_stn = distance_to_wait_stn
+        self.delay = delay
+        self.delay_desc = delay_desc
+        self.opt_arrival_time = opt_arrival_time
+        self.optimistic_time = optimistic_time
+
+    def to_snapshot(self) -> list:
+        """转换为可序列化的列表，字段顺序与 __slots__ 一致"""
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_snapshot(cls, values: list) -> "Bus":
+        return cls(*values)
+
+    @classmethod
+    def from_dict(cls, bus: dict, target_order: int) -> "Bus":
+        """
+        从接口数据构建，只保留目标站点的到站时间
+        数值字段在此处转换为整数并检查范围，后续计算和格式化不再处理异常数据
+        :param bus: data/buses 中的单条数据
+        :param target_order: 目标站点序号
+        :raises KeyError, TypeError, ValueError, OverflowError: 字段缺失或取值异常
+        """
+        opt_arrival_time = 0
+        optimistic_time = 0
+        for travel in bus.get("travels", []):
+            if travel["order"] == target_order:
+                opt_arrival_time = int(travel.get("optArrivalTime", 0))
+                optimistic_time = int(travel.get("optimisticTime", 0))
+                break
+        if not 0 <= opt_arrival_time <= MAX_ARRIVAL_TIME_MS:
+            raise ValueError(f"optArrivalTime out of range: {opt_arrival_time}")
+        if optimistic_time < 0:
+            raise ValueError(f"optimisticTime out of range: {optimistic_time}")
+        return cls(
+            bus_id=bus["busId"],
+            order=int(bus["order"]),
+            distance_to_sc=int(bus.get("distanceToSc", 0)),
+            distance_to_wait_stn=int(bus.get("distanceToWaitStn", 0)),
+            delay=bus["delay"],
+            delay_desc=bus["delayDesc"],
+            opt_arrival_time=opt_arrival_time,
+            optimistic_time=optimistic_time,
+        )
+
+
+class StationTable:
+    """
+    线路站点表，按站点序号排序存储
+    cumulative[i] 为前 i 个站点 distanceToSp 之和，用于 O(log n) 计算站点间距离
+    """
+    __slots__ = ("orders", "names", "cumulative")
+
+    def __init__(self, stations: List[dict]):
+        stations = sorted(stations, key=lambda s: s["order"])
+        self.orders = array("q", (s["order"] for s in stations))
+        self.names = [s["sn"] for s in stations]
+        self.cumulative = array("q", [0])
+        for s in stations:
+            self.cumulative.append(self.cumulative[-1] + s.get("distanceToSp", 0))
+
+    def to_snapshot(self) -> dict:
+        return {"orders": self.orders.tolist(), "names": self.names, "cumulative": self.cumulative.tolist()}
+
+    @classmethod
+    def from_snapshot(cls, data: dict) -> "StationTable":
+        table = cls.__new__(cls)
+        table.orders = array("q", data["orders"])
+        table.names = data["names"]
+        table.cumulative = array("q", data["cumulative"])
+        return table
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def distance(self, start_order: int, end_order: int) -> int:
+        """序号在 (start_order, end_order] 之间的站点 distanceToSp 之和"""
+        if end_order <= start_order:
+            return 0
+        return (self.cumulative[bisect_right(self.orders, end_order)]
+                - self.cumulative[bisect_right(self.orders, start_order)])
+
+    def name_of(self, order: int) -> str:
+        """获取站点名称，不存在时返回空字符串"""
+        index = bisect_right(self.orders, order) - 1
+        if index >= 0 and self.orders[index] == order:
+            return self.names[index]
+        return ""
+
+
+class LineDetail:
+    """线路实时详情，由 lineDetail 接口数据解析而来"""
+    __slots__ = ("short_desc", "desc", "assist_desc", "stations", "buses", "fetched_at")
+
+    def __init__(self, short_desc: str, desc: str, assist_desc: str,
+                 stations: StationTable, buses: List[Bus], fetched_at: Optional[float] = None):
+        self.short_desc = short_desc
+        self.desc = desc
+        self.assist_desc = assist_desc
+        self.stations = stations
+        self.buses = buses
+        # 上游数据获取时间，用于推算两次刷新之间的车辆位置
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+
+    def to_snapshot(self) -> dict:
+        """转换为可序列化的字典，用于在进程间共享"""
+        return {
+            "short_desc": self.short_desc,
+            "desc": self.desc,
+            "assist_desc": self.assist_desc,
+            "stations": self.stations.to_snapshot(),
+            "buses": [bus.to_snapshot() for bus in self.buses],
+            "fetched_at": self.fetched_at,
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: dict) -> "LineDetail":
+        return cls(
+            short_desc=data["short_desc"],
+            desc=data["desc"],
+            assist_desc=data["assist_desc"],
+            stations=StationTable.from_snapshot(data["stations"]),
+            buses=[Bus.from_snapshot(values) for values in data["buses"]],
+            fetched_at=data["fetched_at"],
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict, target_order: int) -> "LineDetail":
+        """
+        解析 async_get_line_detail 返回的数据
+        已驶过目标站点或字段缺失的车辆在此处直接丢弃
+        :param data: 接口 data 字段
+        :param target_order: 目标站点序号
+        """
+        line_info = data.get("line", {})
+        buses = []
+        for bus in data.get("buses", []):
+            try:
+                if bus["order"] <= target_order:
+                    buses.append(Bus.from_dict(bus, target_order))
+            except (KeyError, TypeError, ValueError, OverflowError) as e:
+                logger.error("Error parsing bus info: %s, bus data: %s", e, bus)
+        return cls(
+            short_desc=line_info.get("shortDesc", ""),
+            desc=line_info.get("desc", ""),
+            assist_desc=line_info.get("assistDesc", ""),
+            stations=StationTable(data.get("stations", [])),
+            buses=buses,
+        )
+
 
 class BusApi:
-    def __init__(self):
+    def __init__(self, session: Optional[aiohttp.ClientSession] = None):
+        """
+        :param session: 复用的 aiohttp 会话，为空时每次请求新建会话
+        """
+        self.session = session
         # API endpoints
         self.cityList = config.get("api_endpoint", "cityList")
         self.homePageInfo = config.get("api_endpoint", "homePageInfo")
@@ -33,12 +207,17 @@ class BusApi:
         self.wgs_lng = config.get("location", "wgsLng")
 
     @staticmethod
-    def replace_response_special_chars(string) -> str:
+    def strip_response_markers(raw: bytes) -> memoryview:
         """
-        替换响应中的特殊字符
-        :param string: 字符串
+        去掉响应首尾的特殊标记，返回原始数据的视图，不复制数据
+        标记出现在其他位置时才退回到整体替换
+        :param raw: 响应内容
         """
-        return string.replace("YGKJ##", "").replace("**YGKJ", "")
+        start = len(RESPONSE_PREFIX) if raw.startswith(RESPONSE_PREFIX) else 0
+        end = len(raw) - len(RESPONSE_SUFFIX) if raw.endswith(RESPONSE_SUFFIX) else len(raw)
+        if raw.find(RESPONSE_PREFIX, start, end) != -1 or raw.find(RESPONSE_SUFFIX, start, end) != -1:
+            return memoryview(raw.replace(RESPONSE_PREFIX, b"").replace(RESPONSE_SUFFIX, b""))
+        return memoryview(raw)[start:end]
 
     @staticmethod
     def _clean_request_params(params: Optional[dict]) -> Optional[dict]:
@@ -52,29 +231,25 @@ class BusApi:
         }
 
     @staticmethod
-    async def async_request(url, data=None, headers=None, method="GET", timeout=10):
-        """异步HTTP请求"""
+    async def async_request(url, data=None, headers=None, method="GET", timeout=10,
+                            session: Optional[aiohttp.ClientSession] = None):
+        """异步HTTP请求，传入 session 时复用其连接池"""
         async def process_response(response):
             """处理响应"""
             try:
                 response.raise_for_status()
-                content_type = response.headers.get('Content-Type', '')
+                raw = await response.read()
                 try:
-                    if 'application/json' in content_type:
-                        json_data = await response.json()
-                    else:
-                        text = await response.text()
-                        text = BusApi.replace_response_special_chars(text)
-                        json_data = json.loads(text)
-                except json.JSONDecodeError as e:
+                    json_data = orjson.loads(BusApi.strip_response_markers(raw))
+                except orjson.JSONDecodeError as e:
                     raise BusApiResponseError(
                         f"Failed to parse response as JSON: {str(e)}",
-                        f"raw_text: {await response.text()}",
+                        f"raw_text: {raw.decode(errors='replace')}",
                     )
                 if not isinstance(json_data, dict):
                     raise BusApiResponseError(
                         "Invalid response format",
-                        f"json_data: {await response.text()}",
+                        f"json_data: {raw.decode(errors='replace')}",
                     )
                 jsonr = json_data.get("jsonr", {})
                 if jsonr.get("success") or jsonr.get("status") == "00":
@@ -95,13 +270,17 @@ class BusApi:
             # 清理请求参数
             data = BusApi._clean_request_params(data)
             
-            async with aiohttp.ClientSession() as session:
+            async def send(session):
                 if method == "POST":
                     async with session.post(url, data=data, headers=headers, timeout=timeout) as response:
                         return await process_response(response)
-                else:
-                    async with session.get(url, params=data, headers=headers, timeout=timeout) as response:
-                        return await process_response(response)
+                async with session.get(url, params=data, headers=headers, timeout=timeout) as response:
+                    return await process_response(response)
+
+            if session is not None:
+                return await send(session)
+            async with aiohttp.ClientSession() as session:
+                return await send(session)
         except aiohttp.ClientError as e:
             raise BusApiRequestError(f"Request failed: {str(e)}", f"url: {url}, data: {data}")
         except Exception as e:
@@ -124,7 +303,7 @@ class BusApi:
             "src": self.src,
             "userId": self.userId,
         }
-        response = await self.async_request(self.cityList, method="POST", data=params)
+        response = await self.async_request(self.cityList, method="POST", data=params, session=self.session)
         if response:
             return response["data"].get("gpsRealtimeCity")
         return None
@@ -152,7 +331,7 @@ class BusApi:
             "s": self.s,
             "v": self.v,
         }
-        response = await self.async_request(self.homePageInfo, data=params)
+        response = await self.async_request(self.homePageInfo, data=params, session=self.session)
         return response["data"] if response else None
 
     async def async_get_line_detail(self, line_id: str, target_order: int = None, city_id: str = None,
@@ -190,7 +369,7 @@ class BusApi:
             "s": self.s,
             "v": self.v,
         }
-        response = await self.async_request(self.lineDetail, data=params)
+        response = await self.async_request(self.lineDetail, data=params, session=self.session)
         return response["data"] if response else None
 
     async def get_buses_detail(self, target_order: str, line_id: str,
@@ -221,7 +400,7 @@ class BusApi:
             "s": self.s,
             "v": self.v,
         }
-        response = await self.async_request(self.busesDetail, data=params)
+        response = await self.async_request(self.busesDetail, data=params, session=self.session)
         return response["data"] if response else None
 
     async def get_time_table(self, line_id: str, s_id: str = None, city_id: str = None,
@@ -245,7 +424,7 @@ class BusApi:
             "s": self.s,
             "v": self.v,
         }
-        response = await self.async_request(self.getBusTime, data=params)
+        response = await self.async_request(self.getBusTime, data=params, session=self.session)
         return response["data"] if response else None
 
     async def get_geocodes(self, city: str, address: str, key: str = None) -> Optional[list]:
@@ -255,7 +434,7 @@ class BusApi:
             "address": address,
             "city": city
         }
-        response = await self.async_request(config.get("amap", "geo_url"), data=params)
+        response = await self.async_request(config.get("amap", "geo_url"), data=params, session=self.session)
         if response and response.get("count") and response["geocodes"]:
             return response["geocodes"]
         return None
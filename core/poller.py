@@ -0,0 +1,164 @@
+"""
+多进程轮询
+
+将关注线路按城市分组后分配给多个轮询进程，每个进程使用独立的事件循环和连接池定时刷新线路实时数据，
+解析后的结果写入共享内存目录，HTTP 进程通过 LineSnapshotStore 直接读取，不再各自请求上游。
+
+启动方式（同时在 config.toml 中设置 [poller] enabled = true）:
+    python -m core.poller
+"""
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import aiohttp
+
+from config import config
+from core.api import BusApi
+from core.exceptions import BusQueryError
+from core.query import BusQuery, LineInfo, line_real_key
+from core.snapshot import LineSnapshotStore
+from log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_poll_lines() -> List[Dict]:
+    """获取需要轮询的线路，补全每条线路的城市和目标站点"""
+    default_city_id = config.get("location", "cityId")
+    default_station = config.get("target_station", {}).get("name")
+    return [
+        {
+            "line_id": line["line_id"],
+            "city_id": line.get("city_id", default_city_id),
+            "station": line.get("station", default_station),
+        }
+        for line in config.get("focus_line", [])
+    ]
+
+
+def shard_lines(lines: List[Dict], workers: int) -> List[List[Dict]]:
+    """
+    将线路分配到各个轮询进程
+    同一城市的线路尽量分到同一进程以复用连接，城市线路过多时按平均负载拆分
+    :param lines: get_poll_lines 返回的线路
+    :param workers: 进程数
+    :return: 每个进程负责的线路，不包含空分片
+    """
+    if not lines:
+        return []
+    workers = max(1, min(workers, len(lines)))
+    chunk_size = math.ceil(len(lines) / workers)
+
+    by_city = defaultdict(list)
+    for line in lines:
+        by_city[line["city_id"]].append(line)
+
+    chunks = []
+    for city_lines in by_city.values():
+        chunks.extend(city_lines[i:i + chunk_size] for i in range(0, len(city_lines), chunk_size))
+    # 大的分块优先分配给当前负载最小的进程
+    chunks.sort(key=len, reverse=True)
+
+    shards = [[] for _ in range(workers)]
+    for chunk in chunks:
+        min(shards, key=len).extend(chunk)
+    return [shard for shard in shards if shard]
+
+
+async def poll_shard(lines: List[Dict], store: LineSnapshotStore, interval: float):
+    """在当前进程中循环刷新一组线路"""
+    connector = aiohttp.TCPConnector(limit=config.get("poller", "connections", 20))
+    async with aiohttp.ClientSession(connector=connector) as session:
+        query = BusQuery(BusApi(session=session), record_arrivals=True)
+        # 同一线路可以配置多个目标站点或城市
+        resolved: Dict[Tuple[str, str, str], LineInfo] = {}
+        while True:
+            started = time.monotonic()
+            for line in lines:
+                key = (line["line_id"], line["station"], line["city_id"])
+                if key not in resolved:
+                    try:
+                        line_info = await query.get_line_with_order(line["line_id"], line["station"], line["city_id"])
+                    except BusQueryError as e:
+                        # 上游暂时不可用，下一轮重试
+                        logger.warning("Failed to resolve line %s: %s", line["line_id"], e)
+                        continue
+                    if line_info:
+                        resolved[key] = line_info
+                    else:
+                        logger.warning("Station %s not found in line %s", line["station"], line["line_id"])
+
+            line_infos = list(resolved.values())
+            details = await asyncio.gather(*(query.refresh_line_data(l) for l in line_infos))
+            for line_info, detail in zip(line_infos, details):
+                if detail:
+                    store.write(line_real_key(line_info), detail)
+
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+def run_shard(lines: List[Dict], snapshot_dir: str, interval: float):
+    """轮询进程入口"""
+    # 子进程继承了主进程的信号处理，恢复默认行为
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    setup_logging()
+    logger.info("Poller %s started with %s lines", os.getpid(), len(lines))
+    asyncio.run(poll_shard(lines, LineSnapshotStore(snapshot_dir), interval))
+
+
+def main():
+    setup_logging()
+    workers = config.get("poller", "workers", os.cpu_count() or 1)
+    interval = config.get("poller", "interval", 5)
+    snapshot_dir = config.get("poller", "snapshot_dir", "/dev/shm/realtimebus")
+
+    shards = shard_lines(get_poll_lines(), workers)
+    if not shards:
+        logger.warning("No focus lines configured, poller exits")
+        return
+
+    processes: Dict[int, multiprocessing.Process] = {}
+
+    def start(index: int):
+        process = multiprocessing.Process(
+            target=run_shard, args=(shards[index], snapshot_dir, interval), daemon=True
+        )
+        process.start()
+        processes[index] = process
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    # systemd / kill 默认发送 SIGTERM，退出前需要结束子进程，否则子进程会继续轮询
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        for index in range(len(shards)):
+            start(index)
+        logger.info("Started %s poller processes", len(shards))
+
+        # 轮询进程异常退出时自动重启
+        while True:
+            time.sleep(interval)
+            for index, process in list(processes.items()):
+                if not process.is_alive():
+                    logger.error("Poller %s exited with code %s, restarting", process.pid, process.exitcode)
+                    start(index)
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Stopping %s poller processes", len(processes))
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,19 @@
 import logging
 import time
-from typing import List, Dict, Optional
+from datetime import date
+from typing import AsyncIterator, List, Dict, Optional, Set, Tuple
 from dataclasses import dataclass
 import asyncio
 from cachetools import TTLCache
 
 from config import config
-from core.api import BusApi
+from core.analytics import ArrivalAnalytics
+from core.api import BusApi, Bus, LineDetail, StationTable
 from core.exceptions import BusApiError, BusQueryError
+from core.ranking import ArrivalRanking, LineEntry
+from core.snapshot import LineSnapshotStore, RealtimeSnapshots
+from core.tracking import BusTracker
+from log import LazyStr
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +25,7 @@ class LineInfo:
     target_station_order: int
     target_station_id: str
     target_station_name: str
+    city_id: Optional[str] = None
 
 
 def convert_time_to_str(minutes: int) -> str:
@@ -30,14 +37,59 @@ def convert_time_to_str(minutes: int) -> str:
     return f"{minutes // 60}分钟{minutes % 60}秒"
 
 
-line_cache = TTLCache(maxsize=len(config.get("focus_line", [])) * 2, ttl=config.get("system", "line_cache_ttl", 60*60*24))
-line_real_cache = TTLCache(maxsize=len(config.get("focus_line", [])) * 2, ttl=config.get("system", "line_real_cache_ttl", 10))
+def line_real_key(line: LineInfo) -> str:
+    """
+    线路实时数据的缓存键，上游返回的数据与城市和目标站点有关
+    未单独配置城市的线路使用默认城市，与轮询进程补全后的线路一致
+    """
+    city_id = line.city_id or config.get("location", "cityId")
+    return f"line_{city_id}_{line.line_id}_{line.target_station_order}"
+
+
+# 批量查询可能涉及关注线路以外的线路，额外预留缓存空间
+batch_cache_size = config.get("system", "batch_cache_size", 64)
+line_cache = TTLCache(maxsize=len(config.get("focus_line", [])) * 2 + batch_cache_size, ttl=config.get("system", "line_cache_ttl", 60*60*24))
+line_real_cache = TTLCache(maxsize=len(config.get("focus_line", [])) * 2 + batch_cache_size, ttl=config.get("system", "line_real_cache_ttl", 10))
 time_table_cache = TTLCache(maxsize=len(config.get("focus_line", [])), ttl=config.get("system", "time_table_cache_ttl", 60*60*24))
+# 正在进行中的线路实时请求，同一线路的并发查询共用一次上游请求
+line_real_inflight: Dict[str, asyncio.Task] = {}
+# 后台写入到站统计的任务，保留引用避免被垃圾回收
+arrival_record_tasks: Set[asyncio.Task] = set()
+realtime_snapshots = RealtimeSnapshots(max_history=config.get("system", "realtime_snapshot_history", 30))
+bus_tracker = BusTracker(max_extrapolation=config.get("system", "interpolation_max_seconds", 60))
+arrival_ranking = ArrivalRanking()
+# 启用多进程轮询时，优先读取轮询进程写入的线路数据
+line_snapshot_store = (
+    LineSnapshotStore(config.get("poller", "snapshot_dir", "/dev/shm/realtimebus"))
+    if config.get("poller", "enabled", False) else None
+)
+# 到站可靠性统计，在刷新线路实时数据的进程中记录（启用 poller 时为轮询进程）
+arrival_analytics = (
+    ArrivalAnalytics(
+        directory=config.get("analytics", "data_dir", "data/analytics"),
+        bunching_ratio=config.get("analytics", "bunching_ratio", 0.25),
+        bunching_seconds=config.get("analytics", "bunching_seconds", 120),
+        tolerance=config.get("analytics", "tolerance", 0.5),
+        # 默认允许错过两次刷新
+        max_gap=config.get("analytics", "max_observation_gap", 3 * (
+            config.get("poller", "interval", 5) if config.get("poller", "enabled", False)
+            else config.get("system", "line_real_cache_ttl", 10)
+        )),
+    )
+    if config.get("analytics", "enabled", False) else None
+)
 
 
 class BusQuery:
-    def __init__(self):
-        self.api = BusApi()
+    def __init__(self, api: Optional[BusApi] = None, record_arrivals: Optional[bool] = None):
+        """
+        :param record_arrivals: 刷新线路数据时是否记录到站统计，默认只在未启用 poller 时记录，
+                                启用 poller 时由轮询进程记录
+        """
+        self.api = api if api else BusApi()
+        if record_arrivals is None:
+            record_arrivals = line_snapshot_store is None
+        self.record_arrivals = record_arrivals and arrival_analytics is not None
 
     def _get_target_station_info(self):
         """获取目标站点配置信息"""
@@ -50,14 +102,18 @@ class BusQuery:
 
     async def _fetch_line_details(self, lines: List[Dict]) -> List[Dict]:
         """获取所有线路详情"""
-        tasks = [self.api.async_get_line_detail(line_id=line["line_id"]) for line in lines]
+        tasks = [
+            self.api.async_get_line_detail(line_id=line["line_id"], city_id=line.get("city_id"))
+            for line in lines
+        ]
         try:
             results = await asyncio.gather(*tasks, return_exceptions=True)
             return results
         except Exception as e:
             raise BusQueryError(f"Failed to gather line details: {str(e)}")
 
-    def _process_line_detail(self, line: Dict, target_station_name: str) -> Optional[LineInfo]:
+    def _process_line_detail(self, line: Dict, target_station_name: str,
+                             city_id: Optional[str] = None) -> Optional[LineInfo]:
         """处理单条线路详情，主要是找到目标站点在该线路中的站点序号"""
         try:
             line_info = line.get("line", {})
@@ -69,11 +125,12 @@ class BusQuery:
                         line_name=line_info["name"],
                         target_station_order=station["order"],
                         target_station_id=station["sId"],
-                        target_station_name=station["sn"]
+                        target_station_name=station["sn"],
+                        city_id=city_id
                     )
             return None
         except Exception as e:
-            logger.error(f"Error processing line data: {str(e)}, data: {line}")
+            logger.error("Error processing line data: %s, data: %s", e, line)
             return None
 
     async def get_lines_with_order(self) -> List[LineInfo]:
@@ -81,133 +138,381 @@ class BusQuery:
         try:
             # 获取配置信息
             lines, target_station_name = self._get_target_station_info()
-            # 检查缓存，key 为 lines_with_order_每个线路的line_id
-            cache_key = f"lines_with_order_{'@'.join([line['line_id'] for line in lines])}"
+            # 检查缓存，key 包含目标站点及每条线路的 line_id / station / city_id，修改配置后立即生效
+            cache_key = f"lines_with_order_{target_station_name}_" + "@".join(
+                f"{line['line_id']}:{line.get('station', '')}:{line.get('city_id', '')}" for line in lines
+            )
             if cached_data := line_cache.get(cache_key):
                 return cached_data
-            logger.info(f"Lines with order cache key: {cache_key} not found, fetching data")
+            logger.info("Lines with order cache key: %s not found, fetching data", cache_key)
             # 获取线路详情
             line_details = await self._fetch_line_details(lines)
             # 处理每条线路
             target_station_in_line_order_list = []
-            for line in line_details:
+            for focus_line, line in zip(lines, line_details):
                 if isinstance(line, Exception):
-                    logger.error(f"Error fetching line detail: {str(line)}")
+                    logger.error("Error fetching line detail: %s", line)
                     continue
                 if not line:
                     continue
-                if line_info := self._process_line_detail(line, target_station_name):
+                # 关注线路可单独配置 station / city_id，用于多城市
+                station_name = focus_line.get("station", target_station_name)
+                if line_info := self._process_line_detail(line, station_name, focus_line.get("city_id")):
                     target_station_in_line_order_list.append(line_info)
             if not target_station_in_line_order_list:
-                logger.warning(f"No lines found with target station: {target_station_name}")
+                logger.warning("No lines found with target station: %s", target_station_name)
             # 更新缓存
             line_cache[cache_key] = target_station_in_line_order_list
             return target_station_in_line_order_list
         except BusApiError as e:
-            logger.error(f"API error in get_lines_with_order: {str(e)}")
+            logger.error("API error in get_lines_with_order: %s", e)
             raise BusQueryError(f"Failed to get lines: {str(e)}")
         except Exception as e:
-            logger.error(f"Unexpected error in get_lines_with_order: {str(e)}")
+            logger.error("Unexpected error in get_lines_with_order: %s", e)
             raise BusQueryError(f"Unexpected error: {str(e)}")
 
-    async def _fetch_line_data(self, line: LineInfo) -> Optional[Dict]:
-        """获取线路数据，优先从缓存获取"""
-        cache_key = f"line_{line.line_id}"
+    async def get_line_with_order(self, line_id: str, target_station_name: str,
+                                  city_id: Optional[str] = None) -> Optional[LineInfo]:
+        """
+        获取指定线路中目标站点的信息，站点不在线路中时返回 None
+        :raises BusQueryError: 上游接口请求失败
+        """
+        cache_key = f"line_with_order_{city_id}_{line_id}_{target_station_name}"
+        if cached_data := line_cache.get(cache_key):
+            return cached_data
+        try:
+            data = await self.api.async_get_line_detail(line_id=line_id, city_id=city_id)
+        except BusApiError as e:
+            logger.error("API error in get_line_with_order: %s", e)
+            raise BusQueryError(f"Failed to get line {line_id}: {str(e)}")
+        if not data:
+            return None
+        line_info = self._process_line_detail(data, target_station_name, city_id)
+        if line_info:
+            line_cache[cache_key] = line_info
+        return line_info
+
+    async def _fetch_line_data(self, line: LineInfo) -> Optional[LineDetail]:
+        """获取线路数据，优先从缓存获取，同一线路的并发请求只访问一次上游"""
+        cache_key = line_real_key(line)
         if cached_data := line_real_cache.get(cache_key):
             return cached_data
-        # logger.info(f"Line cache key: {cache_key} not found, fetching data")
+        if line_snapshot_store is not None:
+            if detail := line_snapshot_store.read(cache_key, config.get("poller", "max_age", 30)):
+                line_real_cache[cache_key] = detail
+                return detail
+        task = line_real_inflight.get(cache_key)
+        if task is None:
+            # 上游请求在独立的任务中执行，发起请求的调用方被取消时不影响其他等待者
+            task = asyncio.ensure_future(self.refresh_line_data(line))
+            line_real_inflight[cache_key] = task
+
+            def _done(done: asyncio.Task):
+                if line_real_inflight.get(cache_key) is done:
+                    del line_real_inflight[cache_key]
+
+            task.add_done_callback(_done)
+        return await asyncio.shield(task)
+
+    async def refresh_line_data(self, line: LineInfo) -> Optional[LineDetail]:
+        """请求上游线路实时数据并写入缓存"""
+        cache_key = line_real_key(line)
         try:
             data = await self.api.async_get_line_detail(
                 line_id=line.line_id,
-                target_order=line.target_station_order
+                target_order=line.target_station_order,
+                city_id=line.city_id
             )
             if not data:
-                logger.warning(f"No data returned for line {line.line_name}")
+                logger.warning("No data returned for line %s", line.line_name)
                 return None
 
-            result = {
-                "line_info": data.get("line", {}),
-                "stations": data.get("stations", []),
-                "buses": data.get("buses", [])
-            }
-
+            result = LineDetail.from_dict(data, line.target_station_order)
             line_real_cache[cache_key] = result
+            if self.record_arrivals:
+                self._record_arrivals(line, result)
             return result
 
         except BusApiError as e:
-            logger.error(f"API error fetching line detail: {str(e)}")
+            logger.error("API error fetching line detail: %s", e)
             return None
         except Exception as e:
-            logger.error(f"Error fetching line detail: {str(e)}")
+            logger.error("Error fetching line detail: %s", e)
             return None
 
-    def _get_next_station_name(self, stations: List[Dict], target_station_order: int) -> str:
-        """获取目标站点的下一站名称"""
-        return next(
-            (s["sn"] for s in stations if s["order"] == target_station_order + 1),
-            ""
-        )
-
-    async def async_query_line(self, line: LineInfo) -> Optional[Dict]:
-        """异步查询单条线路信息"""
+    def _record_arrivals(self, line: LineInfo, detail: LineDetail):
+        """
+        检测本次刷新中到达目标站点的车辆，在后台任务中计入统计
+        获取时间表和写文件不阻塞等待线路数据的请求
+        """
+        line_key = line_real_key(line)
         try:
-            # 获取线路数据
-            line_data = await self._fetch_line_data(line)
-            if not line_data:
-                return None
-
-            line_info = line_data["line_info"]
-            stations = line_data["stations"]
-            buses = line_data["buses"]
-
-            # 获取下一站名称
-            target_station_next_name = self._get_next_station_name(stations, line.target_station_order)
-
-            # 处理实时公交信息
-            realtime_info_list = []
-            for bus in buses:
-                if bus_info := self.process_bus_info(bus, line.target_station_order, stations):
-                    realtime_info_list.append(bus_info)
-
-            realtime_info_list.sort(key=lambda x: x.get("optimistic_time", 0))
-
-            # 构建返回数据
-            return {
+            # 多个进程刷新同一线路时只由持有写锁的进程记录
+            if not arrival_analytics.acquire_writer(line_key):
+                return
+            arrivals = arrival_analytics.detect_arrivals(line_key, line.target_station_order, detail)
+        except Exception as e:
+            logger.error("Error detecting arrivals for line %s: %s", line.line_name, e)
+            return
+        if not arrivals:
+            return
+        task = asyncio.ensure_future(self._save_arrivals(line, line_key, arrivals))
+        arrival_record_tasks.add(task)
+        task.add_done_callback(arrival_record_tasks.discard)
+
+    async def _save_arrivals(self, line: LineInfo, line_key: str, arrivals: List[float]):
+        try:
+            timetable = None
+            if arrival_analytics.needs_schedule(line_key):
+                timetable = await self.get_dep_time(line.line_id, line.city_id, line.target_station_id)
+            await arrival_analytics.record(line_key, arrivals, timetable)
+        except Exception as e:
+            logger.error("Error recording arrivals for line %s: %s", line.line_name, e)
+
+    async def get_reliability(self, line_id: str, start: date, end: date) -> Optional[Dict]:
+        """
+        查询关注线路在目标站点的到站可靠性统计
+        :return: 线路不在关注列表中时返回 None
+        """
+        if arrival_analytics is None:
+            raise BusQueryError("Analytics not enabled")
+        lines = await self.get_lines_with_order()
+        line = next((l for l in lines if l.line_id == line_id), None)
+        if not line:
+            return None
+        return {
+            "line_id": line.line_id,
+            "line_name": line.line_name,
+            "target_station_name": line.target_station_name,
+            "hours": await arrival_analytics.query(line_real_key(line), start, end),
+        }
+
+    async def get_reliability_lines(self) -> List[Dict]:
+        """列出关注线路及已有统计数据的日期"""
+        if arrival_analytics is None:
+            raise BusQueryError("Analytics not enabled")
+        lines = await self.get_lines_with_order()
+        days = await asyncio.gather(*(arrival_analytics.days(line_real_key(line)) for line in lines))
+        return [
+            {
                 "line_id": line.line_id,
                 "line_name": line.line_name,
-                "line_info_short_desc": line_info.get("shortDesc", ""),
-                "line_desc": line_info.get("desc", ""),
-                "line_assist_desc": line_info.get("assistDesc", ""),
                 "target_station_name": line.target_station_name,
-                "target_station_next_station_name": target_station_next_name,
-                "realtime_bus_info": realtime_info_list
+                "days": line_days,
             }
+            for line, line_days in zip(lines, days)
+        ]
+
+    def _get_next_station_name(self, stations: StationTable, target_station_order: int) -> str:
+        """获取目标站点的下一站名称"""
+        return stations.name_of(target_station_order + 1)
 
+    async def _get_line_entry(self, line: LineInfo) -> Optional[LineEntry]:
+        """获取线路的排序索引，线路数据刷新后才重新计算"""
+        line_data = await self._fetch_line_data(line)
+        if not line_data:
+            return None
+        line_key = line_real_key(line)
+        entry = arrival_ranking.get(line_key)
+        if entry is not None and entry.detail.fetched_at == line_data.fetched_at:
+            return entry
+
+        stations = line_data.stations
+        buses = [
+            (line_data.fetched_at + bus.optimistic_time, bus,
+             self.calculate_distance_to_target(bus, line.target_station_order, stations))
+            for bus in line_data.buses
+        ]
+        entry = LineEntry(line, line_data, self._get_next_station_name(stations, line.target_station_order), buses)
+        arrival_ranking.update(line_key, entry)
+        return entry
+
+    def _render_line(self, entry: LineEntry, interpolate: bool = True) -> Dict:
+        """
+        生成线路的返回数据
+        :param interpolate: 是否按车速推算当前的剩余距离和到站时间，推算结果同一秒内复用；
+                            为 False 时返回上游观测值，只在线路刷新后生成一次
+        """
+        now = time.time()
+        if not interpolate and entry.observed is not None:
+            return entry.observed
+        if interpolate and entry.rendered_at == int(now):
+            return entry.rendered
+
+        line = entry.line
+        line_data = entry.detail
+        line_key = line_real_key(line)
+        realtime_info_list = []
+        for _, bus, distance_to_target in entry.buses:
+            track_key = f"{line_key}_{bus.bus_id}"
+            optimistic_time = bus.optimistic_time
+            interpolated = False
+            speed = bus_tracker.observe(track_key, line_data.fetched_at, distance_to_target)
+            if interpolate:
+                distance_to_target, optimistic_time, interpolated = bus_tracker.estimate(
+                    track_key, line_data.fetched_at, distance_to_target, optimistic_time, now
+                )
+            realtime_info_list.append(self.process_bus_info(
+                bus, line.target_station_order, distance_to_target, optimistic_time, interpolated, speed
+            ))
+
+        result = {
+            "line_id": line.line_id,
+            "line_name": line.line_name,
+            "line_info_short_desc": line_data.short_desc,
+            "line_desc": line_data.desc,
+            "line_assist_desc": line_data.assist_desc,
+            "target_station_name": line.target_station_name,
+            "target_station_next_station_name": entry.next_station_name,
+            "observed_at": line_data.fetched_at,
+            "realtime_bus_info": realtime_info_list
+        }
+        if interpolate:
+            entry.rendered, entry.rendered_at = result, int(now)
+        else:
+            entry.observed = result
+        return result
+
+    def _try_render_line(self, entry: LineEntry, interpolate: bool = True) -> Optional[Dict]:
+        """生成线路的返回数据，单条线路出错时记录日志并返回 None，不影响其他线路"""
+        try:
+            return self._render_line(entry, interpolate)
         except Exception as e:
-            logger.error(f"Unexpected error in async_query_line: {str(e)}")
+            logger.error("Error rendering line %s: %s", entry.line.line_name, e)
             return None
 
-    async def async_query(self) -> List[Dict]:
-        """异步并行查询所有线路的实时公交信息"""
+    async def async_query_line(self, line: LineInfo) -> Optional[Dict]:
+        """异步查询单条线路信息"""
         try:
-            lines_with_order = await self.get_lines_with_order()
-            logger.info(f"query {len(lines_with_order)} lines with target station, line names: {', '.join([l.line_name for l in lines_with_order])}")
+            entry = await self._get_line_entry(line)
+            return self._render_line(entry) if entry else None
+        except Exception as e:
+            logger.error("Unexpected error in async_query_line: %s", e)
+            return None
 
-            tasks = [self.async_query_line(line) for line in lines_with_order]
-            results = await asyncio.gather(*tasks)
+    async def _refresh_lines(self) -> Set[str]:
+        """刷新所有关注线路的排序索引，返回可用线路的 line_key"""
+        lines_with_order = await self.get_lines_with_order()
+        logger.info(
+            "query %s lines with target station, line names: %s",
+            len(lines_with_order), LazyStr(lambda: ", ".join(l.line_name for l in lines_with_order))
+        )
+        entries = await asyncio.gather(
+            *(self._get_line_entry(line) for line in lines_with_order), return_exceptions=True
+        )
+        line_keys = set()
+        for line, entry in zip(lines_with_order, entries):
+            if isinstance(entry, Exception):
+                logger.error("Unexpected error refreshing line %s: %s", line.line_name, entry)
+            elif entry is not None:
+                line_keys.add(line_real_key(line))
+        return line_keys
+
+    async def async_query(self, interpolate: bool = True) -> List[Dict]:
+        """
+        异步并行查询所有线路的实时公交信息，按首辆车预计到站时间排序
+        :param interpolate: 是否返回按车速推算的剩余距离和到站时间
+        """
+        try:
+            line_keys = await self._refresh_lines()
+            results = [self._try_render_line(entry, interpolate) for entry in arrival_ranking.ordered_lines(line_keys)]
+            return [result for result in results if result]
+        except Exception as e:
+            logger.error("Unexpected error in async_query: %s", e)
+            return []
 
-            bus_realtime_info = [r for r in results if r is not None]
-            bus_realtime_info.sort(
-                key=lambda x: x["realtime_bus_info"][0].get("optimistic_time", float("inf"))
-                if x["realtime_bus_info"] else float("inf")
-            )
-            return bus_realtime_info
+    async def async_query_next_arrivals(self, limit: int) -> List[Dict]:
+        """
+        查询目标站点所有关注线路中最早到站的 limit 辆车
+        :param limit: 返回的车辆数
+        """
+        try:
+            line_keys = await self._refresh_lines()
+            arrivals = []
+            failed: Set[str] = set()
+            # 渲染失败的线路跳过，由后面的车辆补足 limit
+            for entry, bus_id in arrival_ranking.top(len(arrival_ranking), line_keys):
+                if len(arrivals) >= limit:
+                    break
+                line_key = line_real_key(entry.line)
+                if line_key in failed:
+                    continue
+                line_result = self._try_render_line(entry)
+                if not line_result:
+                    failed.add(line_key)
+                    continue
+                bus_info = next(b for b in line_result["realtime_bus_info"] if b["bus_id"] == bus_id)
+                arrivals.append({
+                    "line_id": line_result["line_id"],
+                    "line_name": line_result["line_name"],
+                    "target_station_name": line_result["target_station_name"],
+                    **bus_info,
+                })
+            return arrivals
         except Exception as e:
-            logger.error(f"Unexpected error in async_query: {str(e)}")
+            logger.error("Unexpected error in async_query_next_arrivals: %s", e)
             return []
 
+    async def async_query_snapshot(self, since: Optional[str] = None) -> Dict:
+        """
+        带版本号的实时查询
+        版本和增量基于上游观测值计算，推算值每秒都在变化，由客户端根据 observed_at 和 speed 自行倒计时
+        :param since: 客户端最后一次拿到的版本号，为空或已过期时返回全量数据，否则只返回变化的车辆
+        """
+        results = await self.async_query(interpolate=False)
+        # 客户端用于校准时钟和限制倒计时的推算范围
+        clock = {"server_time": time.time(), "interpolation_max_seconds": bus_tracker.max_extrapolation}
+        if not results:
+            return {"full": True, "version": realtime_snapshots.version, "data": results, **clock}
+        version = realtime_snapshots.update(results)
+        if since is not None and (delta := realtime_snapshots.diff(since)) is not None:
+            return {"full": False, **delta, **clock}
+        return {"full": True, "version": version, "data": results, **clock}
+
+    async def _query_pair(self, line_id: str, target_station_name: str) -> Dict:
+        """查询单个 (线路, 站点) 组合，返回 NDJSON 中的一行"""
+        try:
+            line = await self.get_line_with_order(line_id, target_station_name)
+        except BusQueryError:
+            return {
+                "status": 502,
+                "message": f"Failed to fetch line {line_id} from upstream.",
+                "line_id": line_id,
+                "target_station_name": target_station_name,
+            }
+        if not line:
+            return {
+                "status": 404,
+                "message": f"Station {target_station_name} not found in line {line_id}.",
+                "line_id": line_id,
+                "target_station_name": target_station_name,
+            }
+        result = await self.async_query_line(line)
+        if not result:
+            return {
+                "status": 500,
+                "message": f"Failed to fetch line {line_id}.",
+                "line_id": line_id,
+                "target_station_name": target_station_name,
+            }
+        return {"status": 200, "message": "success", "data": result}
+
+    async def async_query_batch(self, pairs: List[Tuple[str, str]]) -> AsyncIterator[Dict]:
+        """
+        批量查询多个 (线路, 站点) 组合，按完成先后逐个返回结果
+        :param pairs: [(line_id, 站点名称), ...]
+        """
+        tasks = [asyncio.ensure_future(self._query_pair(line_id, station)) for line_id, station in pairs]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # 客户端提前断开时取消未完成的查询
+            for task in tasks:
+                task.cancel()
+
     @staticmethod
-    def calculate_distance(stations: List[Dict], start_order: int, end_order: int) -> int:
+    def calculate_distance(stations: StationTable, start_order: int, end_order: int) -> int:
         """计算站点之间的距离"""
         try:
             if start_order <= 0 or end_order <= 0:
@@ -219,89 +524,80 @@ class BusQuery:
             if start_order > end_order:
                 start_order, end_order = end_order, start_order
 
-            distance = 0
-            for station in stations:
-                if start_order < station["order"] <= end_order:
-                    distance += station.get("distanceToSp", 0)
-            return distance
+            return stations.distance(start_order, end_order)
 
         except Exception as e:
-            logger.error(f"Error calculating distance: {str(e)}")
+            logger.error("Error calculating distance: %s", e)
             return 0
 
-    def process_bus_info(self, bus: Dict, target_order: int, stations: List[Dict]) -> Optional[Dict]:
-        """处理单个公交车的实时信息"""
-        try:
-            bus_next_order = bus["order"]
-            if bus_next_order > target_order:
-                return None
-
-            bus_id = bus["busId"]
-            distance_to_sc = bus.get("distanceToSc", 0)
-            distance_to_wait_stn = bus.get("distanceToWaitStn", 0)
-            begin_order = bus_next_order + abs(distance_to_wait_stn) - 1
-
-            distance_to_target = self.calculate_distance(
-                stations, begin_order, target_order
-            ) + distance_to_sc
-
-            # buses/delayDesc 到站时间不准， delay : 1
-            delay = bus["delay"]
-            delay_desc = bus["delayDesc"]
-            # 处理到站时间信息
-            opt_arrival_time = 0
-            optimistic_time = 0
-            for travel in bus.get("travels", []):
-                if travel["order"] == target_order:
-                    opt_arrival_time = travel.get("optArrivalTime", 0)
-                    optimistic_time = travel.get("optimisticTime", 0)
-                    break
-            #  大于1000米用公里表示，小于1000米用米表示
-            distance_to_target_format = (
-                f"{distance_to_target / 1000:.1f}公里"
-                if distance_to_target >= 1000
-                else f"{distance_to_target}米"
-            )
-            opt_arrival_time_display = "已到站"
-            optimistic_time_display = "已到站"
-            bus_desc = "已到站"
-            if delay:
-                opt_arrival_time_display = delay_desc
-                optimistic_time_display = delay_desc
-                bus_desc = delay_desc
-            elif opt_arrival_time:
-                opt_arrival_time_display = time.strftime("%H:%M:%S", time.localtime(opt_arrival_time / 1000))
-                optimistic_time_display = convert_time_to_str(optimistic_time)
-                bus_desc = "即将到站" if bus_next_order == target_order else "正在途中"
-
-            return {
-                "bus_id": bus_id,
-                "distance_to_target": distance_to_target,
-                "distance_to_target_display": distance_to_target_format,
-                "opt_arrival_time": opt_arrival_time,
-                "optimistic_time": optimistic_time,
-                "opt_arrival_time_display": opt_arrival_time_display,
-                "optimistic_time_display": optimistic_time_display,
-                "number_of_stations_away": f"{target_order - bus_next_order}站",
-                "desc": bus_desc,
-            }
-        except Exception as e:
-            logger.error(f"Error processing bus info: {str(e)}, bus data: {bus}")
-            return None
-
-    async def get_dep_time(self, line_id: str) -> Optional[list]:
-        """获取线路的发车时间"""
+    def calculate_distance_to_target(self, bus: Bus, target_order: int, stations: StationTable) -> int:
+        """根据上游数据计算车辆到目标站点的距离"""
+        begin_order = bus.order + abs(bus.distance_to_wait_stn) - 1
+        return self.calculate_distance(stations, begin_order, target_order) + bus.distance_to_sc
+
+    def process_bus_info(self, bus: Bus, target_order: int, distance_to_target: int,
+                         optimistic_time: int, interpolated: bool = False, speed: Optional[float] = None) -> Dict:
+        """
+        处理单个公交车的实时信息
+        :param distance_to_target: 剩余距离
+        :param optimistic_time: 预计到站秒数
+        :param interpolated: 剩余距离和预计到站秒数是否为推算值
+        :param speed: 估算的车速，米/秒
+        """
+        bus_next_order = bus.order
+        # buses/delayDesc 到站时间不准， delay : 1
+        delay_desc = bus.delay_desc
+        opt_arrival_time = bus.opt_arrival_time
+        #  大于1000米用公里表示，小于1000米用米表示
+        distance_to_target_format = (
+            f"{distance_to_target / 1000:.1f}公里"
+            if distance_to_target >= 1000
+            else f"{distance_to_target}米"
+        )
+        opt_arrival_time_display = "已到站"
+        optimistic_time_display = "已到站"
+        bus_desc = "已到站"
+        if bus.delay:
+            opt_arrival_time_display = delay_desc
+            optimistic_time_display = delay_desc
+            bus_desc = delay_desc
+        elif opt_arrival_time:
+            opt_arrival_time_display = time.strftime("%H:%M:%S", time.localtime(opt_arrival_time / 1000))
+            optimistic_time_display = convert_time_to_str(optimistic_time)
+            bus_desc = "即将到站" if bus_next_order == target_order else "正在途中"
+
+        return {
+            "bus_id": bus.bus_id,
+            "distance_to_target": distance_to_target,
+            "distance_to_target_display": distance_to_target_format,
+            "opt_arrival_time": opt_arrival_time,
+            "optimistic_time": optimistic_time,
+            "opt_arrival_time_display": opt_arrival_time_display,
+            "optimistic_time_display": optimistic_time_display,
+            "number_of_stations_away": f"{target_order - bus_next_order}站",
+            "desc": bus_desc,
+            "interpolated": interpolated,
+            "speed": round(speed, 2) if speed is not None else None,
+        }
+
+    async def get_dep_time(self, line_id: str, city_id: Optional[str] = None,
+                           station_id: Optional[str] = None) -> Optional[list]:
+        """
+        获取线路的发车时间
+        :param city_id: 线路所在城市，为空时使用配置中的城市
+        :param station_id: 站点ID，为空时使用配置中的站点
+        """
         try:
-            cache_key = f"time_table_{line_id}"
+            cache_key = f"time_table_{city_id}_{line_id}_{station_id}"
             if cached_data := time_table_cache.get(cache_key):
-                logger.info(f"Time table cache key: {cache_key} found")
+                logger.info("Time table cache key: %s found", cache_key)
                 return cached_data
-            data = await self.api.get_time_table(line_id=line_id)
+            data = await self.api.get_time_table(line_id=line_id, s_id=station_id, city_id=city_id)
             if not data and not data.get("timetable"):
-                logger.warning(f"Failed to get line detail for line {line_id}")
+                logger.warning("Failed to get line detail for line %s", line_id)
                 return None
             time_table_cache[cache_key] = data.get("timetable")
             return data.get("timetable")
         except Exception as e:
-            logger.error(f"Error getting departure time for line {line_id}: {str(e)}")
+            logger.error("Error getting departure time for line %s: %s", line_id, e)
             return None
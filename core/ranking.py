@@ -0,0 +1,98 @@
+import time
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from core.api import Bus, LineDetail
+
+
+class LineEntry:
+    """
+    单条线路最近一次刷新后的处理结果
+    buses 按预计到站的绝对时间（数据获取时间 + optimisticTime）排序，该时间在两次刷新之间不变
+    """
+    __slots__ = ("line", "detail", "next_station_name", "buses", "observed", "rendered_at", "rendered")
+
+    def __init__(self, line, detail: LineDetail, next_station_name: str,
+                 buses: List[Tuple[float, Bus, int]]):
+        """
+        :param line: LineInfo
+        :param buses: [(预计到站时间戳, Bus, 上游数据中的剩余距离), ...]
+        """
+        self.line = line
+        self.detail = detail
+        self.next_station_name = next_station_name
+        self.buses = sorted(buses, key=lambda b: b[0])
+        # 未经推算的返回数据，只在线路刷新后生成一次
+        self.observed: Optional[Dict] = None
+        # 同一秒内的请求共用渲染结果
+        self.rendered_at: Optional[int] = None
+        self.rendered: Optional[Dict] = None
+
+    @property
+    def first_arrival(self) -> float:
+        return self.buses[0][0] if self.buses else float("inf")
+
+
+class ArrivalRanking:
+    """
+    按预计到站时间维护所有线路及车辆的有序索引，只在线路数据刷新时增量更新，
+    查询时直接按顺序读取，无需每次请求重新排序
+    """
+
+    def __init__(self, stale_after: float = 600):
+        """
+        :param stale_after: 超过该秒数未刷新的线路会被移除
+        """
+        self.stale_after = stale_after
+        self._entries: Dict[str, LineEntry] = {}
+        # (首辆车预计到站时间, line_key)
+        self._lines: List[Tuple[float, str]] = []
+        # (预计到站时间, line_key, bus_id)
+        self._arrivals: List[Tuple[float, str, str]] = []
+
+    def __len__(self) -> int:
+        """索引中的车辆总数"""
+        return len(self._arrivals)
+
+    def get(self, line_key: str) -> Optional[LineEntry]:
+        return self._entries.get(line_key)
+
+    @staticmethod
+    def _remove(items: list, item: tuple):
+        index = bisect_left(items, item)
+        if index < len(items) and items[index] == item:
+            del items[index]
+
+    def _discard(self, line_key: str):
+        entry = self._entries.pop(line_key, None)
+        if entry is None:
+            return
+        self._remove(self._lines, (entry.first_arrival, line_key))
+        for arrival_at, bus, _ in entry.buses:
+            self._remove(self._arrivals, (arrival_at, line_key, bus.bus_id))
+
+    def update(self, line_key: str, entry: LineEntry):
+        """线路数据刷新后替换该线路的索引"""
+        self._discard(line_key)
+        self._entries[line_key] = entry
+        insort(self._lines, (entry.first_arrival, line_key))
+        for arrival_at, bus, _ in entry.buses:
+            insort(self._arrivals, (arrival_at, line_key, bus.bus_id))
+
+        deadline = time.time() - self.stale_after
+        for stale_key in [k for k, e in self._entries.items() if e.detail.fetched_at < deadline]:
+            self._discard(stale_key)
+
+    def ordered_lines(self, line_keys: Set[str]) -> List[LineEntry]:
+        """按首辆车预计到站时间返回指定线路，没有车辆的线路排在最后"""
+        return [self._entries[key] for _, key in self._lines if key in line_keys]
+
+    def top(self, limit: int, line_keys: Set[str]) -> Iterable[Tuple[LineEntry, str]]:
+        """按预计到站时间返回指定线路中最早到站的 limit 辆车 (线路, bus_id)"""
+        count = 0
+        for _, key, bus_id in self._arrivals:
+            if count >= limit:
+                return
+            if key in line_keys:
+                count += 1
+                yield self._entries[key], bus_id
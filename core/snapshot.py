@@ -0,0 +1,119 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import orjson
+
+from core.api import LineDetail
+
+
+class RealtimeSnapshots:
+    """
+    实时数据版本快照
+    每次查询结果发生变化时生成新版本，保留最近若干个版本用于计算增量
+    版本号为数据内容的哈希，多进程部署时其他进程生成的版本号只有在内容完全一致时才能命中
+    """
+
+    def __init__(self, max_history: int = 30):
+        self.max_history = max(1, max_history)
+        self.version = ""
+        # version -> {line_id: {"line": 线路信息(不含车辆), "buses": {bus_id: bus_info}}}
+        self._history: "OrderedDict[str, Dict[str, Dict]]" = OrderedDict()
+
+    @staticmethod
+    def _index(results: List[Dict]) -> Dict[str, Dict]:
+        """将查询结果按 line_id / bus_id 建立索引"""
+        indexed = {}
+        for line in results:
+            meta = {k: v for k, v in line.items() if k != "realtime_bus_info"}
+            buses = {bus["bus_id"]: bus for bus in line.get("realtime_bus_info", [])}
+            indexed[line["line_id"]] = {"line": meta, "buses": buses}
+        return indexed
+
+    @staticmethod
+    def _digest(indexed: Dict[str, Dict]) -> str:
+        return hashlib.blake2b(orjson.dumps(indexed, option=orjson.OPT_SORT_KEYS), digest_size=8).hexdigest()
+
+    def update(self, results: List[Dict]) -> str:
+        """写入最新的查询结果，数据有变化时生成新版本，返回当前版本号"""
+        indexed = self._index(results)
+        if self._history and self._history[self.version] == indexed:
+            return self.version
+        self.version = self._digest(indexed)
+        self._history[self.version] = indexed
+        # 数据变回之前的某个版本时，该版本移到最新位置
+        self._history.move_to_end(self.version)
+        while len(self._history) > self.max_history:
+            self._history.popitem(last=False)
+        return self.version
+
+    def diff(self, since: str) -> Optional[Dict]:
+        """
+        计算 since 版本到当前版本的增量
+        :param since: 客户端最后一次拿到的版本号
+        :return: 增量数据；since 版本已过期或不存在时返回 None，调用方应返回全量数据
+        """
+        old = self._history.get(since)
+        if old is None or self.version not in self._history:
+            return None
+        new = self._history[self.version]
+
+        lines = []
+        for line_id, current in new.items():
+            previous = old.get(line_id, {"line": None, "buses": {}})
+            updated = [
+                bus for bus_id, bus in current["buses"].items()
+                if previous["buses"].get(bus_id) != bus
+            ]
+            removed = [bus_id for bus_id in previous["buses"] if bus_id not in current["buses"]]
+            if not updated and not removed and previous["line"] == current["line"]:
+                continue
+            lines.append({
+                **current["line"],
+                "updated_bus_info": updated,
+                "removed_bus_ids": removed,
+            })
+
+        return {
+            "version": self.version,
+            "lines": lines,
+            "removed_line_ids": [line_id for line_id in old if line_id not in new],
+        }
+
+
+class LineSnapshotStore:
+    """
+    线路实时数据的进程间共享存储
+    轮询进程将解析后的 LineDetail 写入共享内存目录（默认 /dev/shm），HTTP 进程直接读取
+    写入时先写临时文件再原子替换，读取方不会读到写了一半的数据
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def write(self, key: str, detail: LineDetail):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(detail.to_snapshot()))
+        os.replace(tmp_path, path)
+
+    def read(self, key: str, max_age: float) -> Optional[LineDetail]:
+        """
+        读取线路数据
+        :param max_age: 数据获取时间距今超过该秒数时视为过期，返回 None
+        """
+        try:
+            with open(self._path(key), "rb") as f:
+                data = orjson.loads(f.read())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return None
+        if time.time() - data["fetched_at"] > max_age:
+            return None
+        return LineDetail.from_snapshot(data)
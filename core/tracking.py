@@ -0,0 +1,81 @@
+import time
+from typing import Optional, Tuple
+
+from cachetools import TTLCache
+
+
+class BusTrack:
+    """单辆车最近一次的上游观测值"""
+    __slots__ = ("observed_at", "distance", "speed")
+
+    def __init__(self, observed_at: float, distance: int, speed: Optional[float] = None):
+        self.observed_at = observed_at
+        self.distance = distance
+        # 米/秒，尚无两次观测时为 None
+        self.speed = speed
+
+
+class BusTracker:
+    """
+    根据相邻两次上游数据估算车辆速度，在两次刷新之间推算剩余距离和到站时间
+    只保存上游观测值，推算结果在读取时计算
+    """
+
+    def __init__(self, max_extrapolation: float = 60, max_speed: float = 25,
+                 smoothing: float = 0.5, ttl: float = 600, maxsize: int = 1024):
+        """
+        :param max_extrapolation: 最多向后推算的秒数，超过后保持不变
+        :param max_speed: 速度上限，米/秒，用于过滤异常数据
+        :param smoothing: 速度指数平滑系数，越大越偏向最近一次观测
+        :param ttl: 车辆长时间没有新观测时丢弃其记录
+        """
+        self.max_extrapolation = max_extrapolation
+        self.max_speed = max_speed
+        self.smoothing = smoothing
+        self._tracks = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def observe(self, key: str, observed_at: float, distance: int) -> Optional[float]:
+        """
+        记录一次上游观测并更新速度估计
+        :return: 当前的速度估计，米/秒，尚无两次观测时为 None
+        """
+        track = self._tracks.get(key)
+        if track is None:
+            self._tracks[key] = BusTrack(observed_at, distance)
+            return None
+        if observed_at <= track.observed_at:
+            return track.speed
+        elapsed = observed_at - track.observed_at
+        moved = track.distance - distance
+        # 距离变大通常是换了一趟或数据抖动，保留原有速度
+        if moved >= 0:
+            speed = min(moved / elapsed, self.max_speed)
+            if track.speed is not None:
+                speed = self.smoothing * speed + (1 - self.smoothing) * track.speed
+            track.speed = speed
+        track.observed_at = observed_at
+        track.distance = distance
+        self._tracks[key] = track
+        return track.speed
+
+    def estimate(self, key: str, observed_at: float, distance: int, optimistic_time: int,
+                 now: Optional[float] = None) -> Tuple[int, int, bool]:
+        """
+        获取车辆当前的剩余距离和预计到站秒数
+        :param key: 车辆唯一标识，需区分线路和目标站点
+        :param observed_at: 上游数据获取时间
+        :param distance: 上游数据中的剩余距离
+        :param optimistic_time: 上游数据中的预计到站秒数
+        :param now: 当前时间，默认为 time.time()
+        :return: (剩余距离, 预计到站秒数, 是否为推算值)
+        """
+        speed = self.observe(key, observed_at, distance)
+        now = time.time() if now is None else now
+        elapsed = min(now - observed_at, self.max_extrapolation)
+        if elapsed <= 0:
+            return distance, optimistic_time, False
+
+        estimated_distance = max(0, round(distance - speed * elapsed)) if speed else distance
+        estimated_time = max(0, round(optimistic_time - elapsed)) if optimistic_time else optimistic_time
+        interpolated = (estimated_distance, estimated_time) != (distance, optimistic_time)
+        return estimated_distance, estimated_time, interpolated
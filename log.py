@@ -0,0 +1,147 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Iterable
+
+import orjson
+from cachetools import TTLCache
+
+from config import config
+
+# 当前请求的ID，由 main.py 中的中间件设置
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+
+class LazyStr:
+    """延迟求值的日志参数，只有日志真正被写出时才会调用 func"""
+    __slots__ = ("func",)
+
+    def __init__(self, func):
+        self.func = func
+
+    def __str__(self) -> str:
+        return str(self.func())
+
+
+class RequestIdFilter(logging.Filter):
+    """在调用线程中为日志记录附加请求ID"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    指定 logger（及其子 logger）中 INFO 及以下级别的日志按 (logger, 消息模板) 限流
+    每个 interval 秒内最多输出 burst 条，被丢弃的条数附加到下一条输出的日志上
+    WARNING 及以上级别和其他 logger 不受影响
+    """
+
+    def __init__(self, interval: float = 10, burst: int = 1, loggers: Iterable[str] = ()):
+        """
+        :param loggers: 需要限流的 logger 名称，通常为每次请求都会输出日志的模块
+        """
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.loggers = tuple(loggers)
+        self._lock = threading.Lock()
+        # key -> (窗口开始时间, 窗口内已输出条数, 已丢弃条数)
+        # 窗口结束后一段时间没有新日志的记录自动清理，消息不是模板时也不会无限增长
+        self._windows: TTLCache = TTLCache(maxsize=1024, ttl=interval * 2 if interval > 0 else 1)
+
+    def _sampled(self, name: str) -> bool:
+        return any(name == logger or name.startswith(f"{logger}.") for logger in self.loggers)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.interval <= 0 or not self._sampled(record.name):
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            start, emitted, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - start >= self.interval:
+                start, emitted = now, 0
+            if emitted >= self.burst:
+                self._windows[key] = (start, emitted, suppressed + 1)
+                return False
+            self._windows[key] = (start, emitted + 1, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """将日志格式化为单行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            "level": record.levelname,
+            "logger": record.name,
+            "line": record.lineno,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if suppressed := getattr(record, "suppressed", 0):
+            data["suppressed"] = suppressed
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(data).decode()
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    标准 QueueHandler 会在调用线程中格式化消息，这里直接入队原始记录，
+    消息拼接和序列化全部放到后台写线程中完成
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_listener = None
+# 创建 _listener 的进程，fork 出的子进程中后台线程不存在，需要重新创建
+_listener_pid = None
+
+
+def setup_logging():
+    """
+    配置日志：调用方只负责把日志记录放入队列，由后台线程格式化为 JSON 并写出
+    重复调用不会重复添加处理器；在 fork 出的子进程中调用时会重新创建队列和后台线程
+    """
+    global _listener, _listener_pid
+    if _listener is not None:
+        if _listener_pid == os.getpid():
+            return
+        atexit.unregister(_listener.stop)
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(SamplingFilter(
+        interval=config.get("logging", "sample_interval", 10),
+        burst=config.get("logging", "sample_burst", 1),
+        loggers=config.get("logging", "sample_loggers", ["main", "__main__", "core.query"]),
+    ))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config.get("logging", "level", "INFO"))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+    atexit.register(_listener.stop)
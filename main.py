@@ -1,23 +1,25 @@
 import json
+from datetime import date, timedelta
+import orjson
 from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from starlette.responses import HTMLResponse
-from starlette.staticfiles import StaticFiles
-from starlette.templating import Jinja2Templates
-from typing import List, Union
+from starlette.responses import HTMLResponse, StreamingResponse
+from typing import List, Optional, Union
 from pydantic import BaseModel, Field
 import uvicorn
 import asyncio
 import logging
+import uuid
+from assets import INDEX_CACHE_CONTROL, AssetStore
+from core.analytics import MAX_QUERY_DAYS
+from core.exceptions import BusQueryError
 from core.query import BusQuery
+from log import request_id_var, setup_logging
 from utils import get_now_time
 
 # 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s[%(lineno)d] - %(levelname)s - %(message)s'
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # 响应模型
@@ -31,6 +33,8 @@ class BusInfo(BaseModel):
     optimistic_time_display: str
     number_of_stations_away: str
     desc: str
+    interpolated: bool = Field(default=False, description="距离和到站时间是否为根据车速推算的值")
+    speed: Optional[float] = Field(default=None, description="估算的车速，米/秒")
 
 class LineRealTimeInfo(BaseModel):
     line_id: str
@@ -40,6 +44,7 @@ class LineRealTimeInfo(BaseModel):
     line_assist_desc: str
     target_station_name: str
     target_station_next_station_name: str
+    observed_at: float = Field(default=0, description="上游数据获取时间戳")
     realtime_bus_info: List[BusInfo]
 
 class RealtimeResponse(BaseModel):
@@ -49,6 +54,47 @@ class RealtimeResponse(BaseModel):
     timestamp: str = Field(description="响应时间")
     data: List[LineRealTimeInfo] = Field(description="实时公交数据")
     frontlimit: int = Field(default=1, description="前端限制显示的线路数量")
+    version: str = Field(default="", description="数据版本号，下次请求时作为 since 参数传入可获取增量")
+    full: bool = Field(default=True, description="是否为全量数据")
+    server_time: float = Field(default=0, description="服务器时间戳，客户端据此从 observed_at 开始倒计时")
+    interpolation_max_seconds: float = Field(default=0, description="客户端最多向后推算的秒数")
+
+class ArrivalInfo(BusInfo):
+    line_id: str
+    line_name: str
+    target_station_name: str
+
+class ArrivalsResponse(BaseModel):
+    status: int = Field(description="状态码，200表示成功")
+    message: str = Field(description="状态描述")
+    total: int = Field(description="返回的车辆数")
+    timestamp: str = Field(description="响应时间")
+    data: List[ArrivalInfo] = Field(description="按预计到站时间排序的车辆")
+
+class LineRealTimeDelta(BaseModel):
+    line_id: str
+    line_name: str
+    line_info_short_desc: str
+    line_desc: str
+    line_assist_desc: str
+    target_station_name: str
+    target_station_next_station_name: str
+    observed_at: float = Field(default=0, description="上游数据获取时间戳")
+    updated_bus_info: List[BusInfo] = Field(description="新增或发生变化的车辆")
+    removed_bus_ids: List[str] = Field(description="已离开的车辆")
+
+class RealtimeDeltaResponse(BaseModel):
+    status: int = Field(description="状态码，200表示成功")
+    message: str = Field(description="状态描述")
+    total: int = Field(description="发生变化的线路总数")
+    timestamp: str = Field(description="响应时间")
+    data: List[LineRealTimeDelta] = Field(description="发生变化的线路")
+    removed_line_ids: List[str] = Field(default=[], description="已不再返回的线路")
+    frontlimit: int = Field(default=1, description="前端限制显示的线路数量")
+    version: str = Field(description="数据版本号")
+    full: bool = Field(default=False, description="是否为全量数据")
+    server_time: float = Field(default=0, description="服务器时间戳，客户端据此从 observed_at 开始倒计时")
+    interpolation_max_seconds: float = Field(default=0, description="客户端最多向后推算的秒数")
 
 class TimeTable(BaseModel):
     eTime: str
@@ -61,6 +107,52 @@ class TimeTableResponse(BaseModel):
     timestamp: str = Field(description="响应时间")
     data: List[TimeTable] = Field(description="发车时间表")
 
+class HourlyReliability(BaseModel):
+    hour: int = Field(description="小时（0-23）")
+    headway_count: int = Field(description="统计到的车头时距数量")
+    headway_mean: float = Field(description="平均车头时距，单位秒")
+    headway_std: float = Field(description="车头时距标准差，单位秒")
+    headway_p50: float = Field(description="车头时距中位数，单位秒")
+    headway_p90: float = Field(description="车头时距90分位数，单位秒")
+    headway_cv: Optional[float] = Field(description="车头时距变异系数，越大越不规律")
+    bunching_events: int = Field(description="串车次数")
+    bunching_rate: float = Field(description="串车比例")
+    scheduled_headway: Optional[float] = Field(description="时间表中的平均发车间隔，单位秒")
+    schedule_adherence: Optional[float] = Field(description="车头时距与计划间隔相符的比例")
+
+class LineReliability(BaseModel):
+    line_id: str
+    line_name: str
+    target_station_name: str
+    hours: List[HourlyReliability]
+
+class ReliabilityResponse(BaseModel):
+    status: int = Field(description="状态码，200表示成功")
+    message: str = Field(description="状态描述")
+    timestamp: str = Field(description="响应时间")
+    start: date = Field(description="统计开始日期")
+    end: date = Field(description="统计结束日期")
+    data: LineReliability = Field(description="到站可靠性统计")
+
+class AnalyticsLine(BaseModel):
+    line_id: str
+    line_name: str
+    target_station_name: str
+    days: List[str] = Field(description="有统计数据的日期")
+
+class AnalyticsLinesResponse(BaseModel):
+    status: int = Field(description="状态码，200表示成功")
+    message: str = Field(description="状态描述")
+    timestamp: str = Field(description="响应时间")
+    data: List[AnalyticsLine] = Field(description="关注线路")
+
+class BatchQueryItem(BaseModel):
+    line_id: str = Field(description="线路ID")
+    station: str = Field(description="站点名称")
+
+class BatchQueryRequest(BaseModel):
+    queries: List[BatchQueryItem] = Field(min_length=1, max_length=50, description="查询的线路和站点列表")
+
 
 # 自定义异常类
 class CustomException(Exception):
@@ -84,10 +176,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 为每个请求生成请求ID，写入日志并通过响应头返回
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # 自定义异常处理
 @app.exception_handler(CustomException)
 async def custom_exception_handler(request: Request, exc: CustomException):
-    logger.error(f"CustomException: {exc.message}")
+    logger.error("CustomException: %s", exc.message)
     return JSONResponse(
         status_code=exc.status,
         content={"status": exc.status, "message": exc.message}
@@ -95,7 +199,7 @@ async def custom_exception_handler(request: Request, exc: CustomException):
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
-    logger.error(f"HTTPException: {exc.detail}")
+    logger.error("HTTPException: %s", exc.detail)
     return JSONResponse(
         status_code=exc.status_code,
         content={"status": exc.status_code, "message": exc.detail}
@@ -103,7 +207,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Unhandled Exception: {str(exc)}", exc_info=True)
+    logger.error("Unhandled Exception: %s", exc, exc_info=True)
     return JSONResponse(
         status_code=500,
         content={"status": 500, "message": "Internal Server Error"}
@@ -123,11 +227,27 @@ async def root():
         "timestamp": get_now_time()
     }
 
-@app.get("/api/v1/bus/realtime", response_model=RealtimeResponse)
-async def get_realtime_bus_info(bus_query: BusQuery = Depends(get_bus_query_system)):
+@app.get("/api/v1/bus/realtime", response_model=Union[RealtimeDeltaResponse, RealtimeResponse])
+async def get_realtime_bus_info(
+        since: Optional[str] = Query(default=None, description="客户端最后一次拿到的数据版本号"),
+        bus_query: BusQuery = Depends(get_bus_query_system)):
     front_limit = 2
     try:
-        results = await bus_query.async_query()
+        snapshot = await bus_query.async_query_snapshot(since)
+        if not snapshot["full"]:
+            return RealtimeDeltaResponse(
+                status=200,
+                message="success",
+                total=len(snapshot["lines"]),
+                timestamp=get_now_time(),
+                data=snapshot["lines"],
+                removed_line_ids=snapshot["removed_line_ids"],
+                frontlimit=front_limit,
+                version=snapshot["version"],
+                server_time=snapshot["server_time"],
+                interpolation_max_seconds=snapshot["interpolation_max_seconds"]
+            )
+        results = snapshot["data"]
         if not results:
             raise CustomException(
                 status=404,
@@ -139,7 +259,10 @@ async def get_realtime_bus_info(bus_query: BusQuery = Depends(get_bus_query_syst
             total=len(results),
             timestamp=get_now_time(),
             data=results,
-            frontlimit=front_limit
+            frontlimit=front_limit,
+            version=snapshot["version"],
+            server_time=snapshot["server_time"],
+            interpolation_max_seconds=snapshot["interpolation_max_seconds"]
         )
     except CustomException:
         raise
@@ -149,6 +272,32 @@ async def get_realtime_bus_info(bus_query: BusQuery = Depends(get_bus_query_syst
             message="Failed to fetch bus information"
         )
 
+@app.get("/api/v1/bus/arrivals", response_model=ArrivalsResponse)
+async def get_next_arrivals(
+        limit: int = Query(default=5, ge=1, le=50, description="返回的车辆数"),
+        bus_query: BusQuery = Depends(get_bus_query_system)):
+    try:
+        results = await bus_query.async_query_next_arrivals(limit)
+        if not results:
+            raise CustomException(
+                status=404,
+                message="No upcoming arrivals."
+            )
+        return ArrivalsResponse(
+            status=200,
+            message="success",
+            total=len(results),
+            timestamp=get_now_time(),
+            data=results
+        )
+    except CustomException:
+        raise
+    except Exception as e:
+        raise CustomException(
+            status=500,
+            message="Failed to fetch arrivals"
+        )
+
 @app.get("/api/v1/bus/time/{line_id}", response_model=TimeTableResponse)
 async def get_line_time(line_id: str, bus_query: BusQuery = Depends(get_bus_query_system)):
     try:
@@ -197,9 +346,66 @@ async def get_line_info(line_name: str, bus_query: BusQuery = Depends(get_bus_qu
             message="Failed to fetch line information"
         )
 
+@app.post("/api/v1/bus/batch")
+async def batch_query(request: BatchQueryRequest, bus_query: BusQuery = Depends(get_bus_query_system)):
+    """批量查询，每条线路查询完成后立即以 NDJSON 格式返回一行"""
+    pairs = [(item.line_id, item.station) for item in request.queries]
+
+    async def generate():
+        async for result in bus_query.async_query_batch(pairs):
+            yield orjson.dumps(result) + b"\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.get("/api/v1/analytics/lines", response_model=AnalyticsLinesResponse)
+async def get_analytics_lines(bus_query: BusQuery = Depends(get_bus_query_system)):
+    try:
+        results = await bus_query.get_reliability_lines()
+        return AnalyticsLinesResponse(
+            status=200,
+            message="success",
+            timestamp=get_now_time(),
+            data=results
+        )
+    except BusQueryError as e:
+        raise CustomException(status=503, message=str(e))
+
+@app.get("/api/v1/analytics/lines/{line_id}/reliability", response_model=ReliabilityResponse)
+async def get_line_reliability(
+        line_id: str,
+        start: Optional[date] = Query(default=None, description="开始日期，默认为结束日期前 6 天，范围最多 31 天"),
+        end: Optional[date] = Query(default=None, description="结束日期，默认为今天"),
+        hour: Optional[int] = Query(default=None, ge=0, le=23, description="只返回指定小时"),
+        bus_query: BusQuery = Depends(get_bus_query_system)):
+    end = end or date.today()
+    start = start or end - timedelta(days=6)
+    if end < start:
+        raise CustomException(status=422, message="end must not be earlier than start.")
+    if (end - start).days + 1 > MAX_QUERY_DAYS:
+        raise CustomException(status=422, message=f"Date range must not exceed {MAX_QUERY_DAYS} days.")
+    try:
+        result = await bus_query.get_reliability(line_id, start, end)
+    except BusQueryError as e:
+        raise CustomException(status=503, message=str(e))
+    if not result:
+        raise CustomException(
+            status=404,
+            message=f"Line {line_id} does not exist."
+        )
+    if hour is not None:
+        result["hours"] = [h for h in result["hours"] if h["hour"] == hour]
+    return ReliabilityResponse(
+        status=200,
+        message="success",
+        timestamp=get_now_time(),
+        start=start,
+        end=end,
+        data=result
+    )
+
 @app.get("/test")
 async def test(file_name: Union[str, None] = Query(default="mock.json", description="The name of the file to read")):
-    logger.info(f"file_name: {file_name}")
+    logger.info("file_name: %s", file_name)
     try:
         with open(f"test/data/{file_name}", "r", encoding="utf-8") as file:
             data = json.load(file)
@@ -215,13 +421,19 @@ async def test(file_name: Union[str, None] = Query(default="mock.json", descript
 async def health_check():
     return {"status": "healthy", "timestamp": get_now_time()}
 
-# 静态文件和模板配置
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+# 静态文件和模板配置：启动时加载并预压缩，首页只渲染一次
+assets = AssetStore(static_dir="static", template_dir="templates", index_template="bus.html")
+
+@app.api_route("/static/{file_name}", methods=["GET", "HEAD"])
+async def static_file(file_name: str, request: Request):
+    asset, cache_control = assets.get_static(file_name)
+    if not asset:
+        raise HTTPException(status_code=404, detail="File not found")
+    return asset.response(request, cache_control)
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
-    return templates.TemplateResponse("bus.html", {"request": request})
+    return assets.index.response(request, INDEX_CACHE_CONTROL)
 
 # 启动代码
 if __name__ == "__main__":
@@ -0,0 +1,7 @@
+import os
+
+# 测试使用示例配置，不依赖本地的 config.toml
+os.environ.setdefault(
+    "REALTIMEBUS_CONFIG",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.toml.example"),
+)
@@ -0,0 +1,167 @@
+import asyncio
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+
+from core.analytics import (
+    HEADWAY_BIN_SECONDS, HOURS, ArrivalAnalytics, DailyAggregate, parse_scheduled_headways, summarize,
+)
+from core.api import Bus, LineDetail
+
+# 本地时间 08:00，保证测试数据都落在同一小时内
+START = datetime(2024, 1, 1, 8, 0).timestamp()
+ARRIVALS = np.array([START + 5, START + 605, START + 615, START + 1205])
+
+
+def make_bus(bus_id: str, order: int) -> Bus:
+    return Bus(bus_id, order, 0, 0, 0, "", 0, 0)
+
+
+def make_detail(fetched_at: float, buses) -> LineDetail:
+    return LineDetail("", "", "", None, buses, fetched_at=fetched_at)
+
+
+def add(aggregate: DailyAggregate, arrivals=ARRIVALS):
+    aggregate.add_arrivals(arrivals, np.nan, max_headway=3 * 60 * 60,
+                           bunching_ratio=0.25, bunching_seconds=120, tolerance=0.5)
+
+
+def test_parse_scheduled_headways():
+    scheduled = parse_scheduled_headways([{"fTime": "08:00", "eTime": "09:00",
+                                           "times": ["08:00", "08:10", "08:20", "bad", "09:00"]}])
+    assert scheduled.shape == (HOURS,)
+    assert scheduled[8] == 600
+    assert scheduled[9] == 2400
+    assert np.isnan(scheduled[7])
+    assert np.isnan(parse_scheduled_headways(None)).all()
+
+
+def test_histogram_percentiles():
+    aggregate = DailyAggregate()
+    add(aggregate)
+    [hour] = summarize([aggregate])
+
+    # 车头时距 600, 10, 590，中位数落在第 9 格，90 分位落在第 10 格
+    assert hour["hour"] == 8
+    assert hour["headway_count"] == 3
+    assert hour["headway_mean"] == 400.0
+    assert hour["headway_p50"] == 9.5 * HEADWAY_BIN_SECONDS
+    assert hour["headway_p90"] == 10.5 * HEADWAY_BIN_SECONDS
+    assert aggregate.last_arrival == ARRIVALS[-1]
+
+
+def test_bunching_without_schedule():
+    aggregate = DailyAggregate()
+    add(aggregate)
+    [hour] = summarize([aggregate])
+
+    assert hour["bunching_events"] == 1
+    assert hour["bunching_rate"] == round(1 / 3, 3)
+    assert hour["scheduled_headway"] is None
+    assert hour["schedule_adherence"] is None
+
+
+def test_bunching_and_adherence_with_schedule():
+    scheduled = np.full(HOURS, np.nan)
+    scheduled[8] = 600
+    aggregate = DailyAggregate(scheduled)
+    add(aggregate)
+    [hour] = summarize([aggregate])
+
+    # 小于 150 秒视为串车，600 和 590 在计划间隔的 ±50% 以内
+    assert hour["bunching_events"] == 1
+    assert hour["scheduled_headway"] == 600
+    assert hour["schedule_adherence"] == round(2 / 3, 3)
+
+
+def test_headways_across_days_and_gaps():
+    aggregate = DailyAggregate()
+    aggregate.add_arrivals(np.array([START + 100, START + 100 + 4 * 60 * 60]), START,
+                           max_headway=3 * 60 * 60, bunching_ratio=0.25, bunching_seconds=120, tolerance=0.5)
+    [hour] = summarize([aggregate])
+
+    # 与前一天最后一次到站的间隔计入统计，超过 max_headway 的间隔不计入
+    assert hour["hour"] == 8
+    assert hour["headway_count"] == 1
+    assert aggregate.last_arrival == START + 100 + 4 * 60 * 60
+
+
+def test_npz_round_trip(tmp_path):
+    scheduled = np.full(HOURS, np.nan)
+    scheduled[8] = 600
+    aggregate = DailyAggregate(scheduled)
+    add(aggregate)
+    path = str(tmp_path / "2024-01-01.npz")
+    DailyAggregate.save_arrays(path, aggregate.to_arrays())
+
+    loaded = DailyAggregate.load(path)
+    for name in DailyAggregate.__slots__:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(aggregate, name))
+    assert isinstance(loaded.last_arrival, float)
+    assert summarize([loaded]) == summarize([aggregate])
+    assert list(tmp_path.iterdir()) == [tmp_path / "2024-01-01.npz"]
+
+
+def test_summarize_merges_days():
+    first, second = DailyAggregate(), DailyAggregate()
+    add(first)
+    add(second)
+    [hour] = summarize([first, second])
+    assert hour["headway_count"] == 6
+    assert hour["bunching_events"] == 2
+    assert summarize([]) == []
+
+
+def test_detect_arrivals_uses_midpoint(tmp_path):
+    analytics = ArrivalAnalytics(str(tmp_path), max_gap=30)
+    assert analytics.detect_arrivals("line", 5, make_detail(100, [make_bus("a", 5), make_bus("b", 3)])) == []
+    # b 不是即将到站的车辆，消失不计入
+    assert analytics.detect_arrivals("line", 5, make_detail(110, [])) == [105]
+    # 重复或更早的观测被忽略
+    assert analytics.detect_arrivals("line", 5, make_detail(110, [])) == []
+
+
+def test_detect_arrivals_ignores_long_gaps(tmp_path):
+    analytics = ArrivalAnalytics(str(tmp_path), max_gap=30)
+    analytics.detect_arrivals("line", 5, make_detail(100, [make_bus("a", 5)]))
+    assert analytics.detect_arrivals("line", 5, make_detail(1000, [make_bus("b", 5)])) == []
+    assert analytics.detect_arrivals("line", 5, make_detail(1020, [])) == [1010]
+
+
+def test_single_writer_per_line(tmp_path):
+    first = ArrivalAnalytics(str(tmp_path))
+    second = ArrivalAnalytics(str(tmp_path))
+    assert first.acquire_writer("line")
+    assert first.acquire_writer("line")
+    assert not second.acquire_writer("line")
+    assert second.acquire_writer("other")
+
+
+def test_record_and_query(tmp_path):
+    analytics = ArrivalAnalytics(str(tmp_path))
+
+    async def run():
+        await analytics.record("line", [])
+        assert await analytics.days("line") == []
+        await analytics.record("line", list(ARRIVALS[:2]))
+        await analytics.record("line", list(ARRIVALS[2:]))
+        # 新实例从文件读取
+        reloaded = ArrivalAnalytics(str(tmp_path))
+        return await reloaded.days("line"), await reloaded.query("line", date.today(), date.today())
+
+    days, hours = asyncio.run(run())
+    assert days == [date.today().isoformat()]
+    assert [(h["hour"], h["headway_count"]) for h in hours] == [(8, 3)]
+
+
+def test_query_without_data(tmp_path):
+    analytics = ArrivalAnalytics(str(tmp_path))
+    assert asyncio.run(analytics.query("line", date(2024, 1, 1), date(2024, 1, 31))) == []
+
+
+@pytest.mark.parametrize("start, end", [(date(2024, 1, 2), date(2024, 1, 1)), (date(2024, 1, 1), date(2024, 2, 1))])
+def test_query_rejects_invalid_range(tmp_path, start, end):
+    analytics = ArrivalAnalytics(str(tmp_path))
+    with pytest.raises(ValueError):
+        asyncio.run(analytics.query("line", start, end))
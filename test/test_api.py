@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from core.api import RESPONSE_PREFIX, RESPONSE_SUFFIX, BusApi, LineDetail, StationTable
+
+
+def loop_distance(stations, start_order: int, end_order: int) -> int:
+    """原先逐个站点累加的实现"""
+    return sum(s.get("distanceToSp", 0) for s in stations if start_order < s["order"] <= end_order)
+
+
+def loop_name_of(stations, order: int) -> str:
+    return next((s["sn"] for s in stations if s["order"] == order), "")
+
+
+@pytest.mark.parametrize("raw, expected", [
+    (RESPONSE_PREFIX + b'{"a": 1}' + RESPONSE_SUFFIX, b'{"a": 1}'),
+    (RESPONSE_PREFIX + b'{"a": 1}', b'{"a": 1}'),
+    (b'{"a": 1}' + RESPONSE_SUFFIX, b'{"a": 1}'),
+    (b'{"a": 1}', b'{"a": 1}'),
+    # 标记出现在中间时整体替换
+    (RESPONSE_PREFIX + b'{"a": "' + RESPONSE_SUFFIX + b'x' + RESPONSE_PREFIX + b'"}' + RESPONSE_SUFFIX,
+     b'{"a": "x"}'),
+    (b'{"a": "' + RESPONSE_PREFIX + b'"}', b'{"a": ""}'),
+    (b"", b""),
+    (RESPONSE_PREFIX + RESPONSE_SUFFIX, b""),
+])
+def test_strip_response_markers(raw, expected):
+    stripped = BusApi.strip_response_markers(raw)
+    assert isinstance(stripped, memoryview)
+    assert bytes(stripped) == expected
+    # 与原先的字符串替换结果一致
+    assert bytes(stripped) == raw.replace(RESPONSE_PREFIX, b"").replace(RESPONSE_SUFFIX, b"")
+
+
+def test_station_table_matches_loop():
+    rng = random.Random(0)
+    # 打乱顺序、跳过部分序号、部分站点缺少 distanceToSp
+    stations = [
+        {"order": order, "sn": f"S{order}", **({"distanceToSp": rng.randint(0, 2000)} if order % 5 else {})}
+        for order in range(1, 40) if order % 7
+    ]
+    rng.shuffle(stations)
+    table = StationTable(stations)
+
+    assert len(table) == len(stations)
+    for start in range(-1, 42):
+        for end in range(-1, 42):
+            assert table.distance(start, end) == loop_distance(stations, start, end)
+    for order in range(-1, 42):
+        assert table.name_of(order) == loop_name_of(stations, order)
+
+    restored = StationTable.from_snapshot(table.to_snapshot())
+    assert restored.distance(3, 30) == table.distance(3, 30)
+    assert restored.name_of(8) == "S8"
+
+
+def test_empty_station_table():
+    table = StationTable([])
+    assert table.distance(0, 10) == 0
+    assert table.name_of(1) == ""
+
+
+def make_bus(bus_id: str, **travel):
+    return {"busId": bus_id, "order": 2, "distanceToSc": 100, "distanceToWaitStn": 0, "delay": 0,
+            "delayDesc": "", "travels": [{"order": 4, "optArrivalTime": 1700000000000, "optimisticTime": 120,
+                                          **travel}]}
+
+
+def test_line_detail_drops_invalid_buses():
+    data = {
+        "line": {"shortDesc": "short"},
+        "stations": [{"order": order, "sn": f"S{order}", "distanceToSp": 100} for order in range(1, 6)],
+        "buses": [
+            make_bus("ok", optimisticTime="90"),
+            make_bus("out_of_range", optArrivalTime=10 ** 20),
+            make_bus("negative", optimisticTime=-1),
+            make_bus("not_a_number", optimisticTime="soon"),
+            make_bus("infinite", optArrivalTime=float("inf")),
+            {**make_bus("bad_distance"), "distanceToSc": None},
+            {**make_bus("passed"), "order": 5},
+            {"busId": "missing_fields", "order": 1},
+        ],
+    }
+    detail = LineDetail.from_dict(data, target_order=4)
+    assert [bus.bus_id for bus in detail.buses] == ["ok"]
+    assert detail.buses[0].optimistic_time == 90
+    assert detail.short_desc == "short"
@@ -0,0 +1,46 @@
+import logging
+
+from log import SamplingFilter
+
+
+def make_record(name: str, msg: str, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, msg, None, None)
+
+
+def test_samples_only_listed_loggers():
+    sampling = SamplingFilter(interval=60, burst=1, loggers=["core.query"])
+    assert sampling.filter(make_record("core.query", "query %s lines"))
+    assert not sampling.filter(make_record("core.query", "query %s lines"))
+    # 子 logger 同样限流
+    assert sampling.filter(make_record("core.query.child", "query %s lines"))
+    assert not sampling.filter(make_record("core.query.child", "query %s lines"))
+    # 其他 logger 和 WARNING 以上级别不限流
+    assert sampling.filter(make_record("uvicorn", "started"))
+    assert sampling.filter(make_record("uvicorn", "started"))
+    assert sampling.filter(make_record("core.queryx", "query %s lines"))
+    assert sampling.filter(make_record("core.query", "query %s lines", logging.WARNING))
+
+
+def test_suppressed_count_is_reported(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("log.time.monotonic", lambda: now[0])
+    sampling = SamplingFilter(interval=10, burst=1, loggers=["main"])
+    assert sampling.filter(make_record("main", "file_name: %s"))
+    assert not sampling.filter(make_record("main", "file_name: %s"))
+    assert not sampling.filter(make_record("main", "file_name: %s"))
+    now[0] = 10.0
+    record = make_record("main", "file_name: %s")
+    assert sampling.filter(record)
+    assert record.suppressed == 2
+
+
+def test_windows_are_bounded():
+    sampling = SamplingFilter(interval=10, burst=1, loggers=["main"])
+    for i in range(5000):
+        sampling.filter(make_record("main", f"pre-formatted message {i}"))
+    assert len(sampling._windows) <= sampling._windows.maxsize
+
+
+def test_disabled_when_interval_is_zero():
+    sampling = SamplingFilter(interval=0, loggers=["main"])
+    assert all(sampling.filter(make_record("main", "same")) for _ in range(3))
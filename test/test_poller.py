@@ -0,0 +1,54 @@
+import time
+
+from core.api import Bus, LineDetail, StationTable
+from core.poller import shard_lines
+from core.snapshot import LineSnapshotStore
+
+
+def make_lines(counts):
+    """counts: {city_id: 线路数}"""
+    return [{"line_id": f"{city}-{i}", "city_id": city, "station": "S"}
+            for city, count in counts.items() for i in range(count)]
+
+
+def test_shard_lines_keeps_cities_together():
+    lines = make_lines({"a": 2, "b": 2})
+    shards = shard_lines(lines, 2)
+    assert sorted({line["city_id"] for line in shard} for shard in shards) == [{"a"}, {"b"}]
+
+
+def test_shard_lines_splits_large_cities_evenly():
+    lines = make_lines({"a": 7, "b": 1})
+    shards = shard_lines(lines, 4)
+    assert len(shards) == 4
+    assert sorted(len(shard) for shard in shards) == [2, 2, 2, 2]
+    assert sorted(line["line_id"] for shard in shards for line in shard) == sorted(l["line_id"] for l in lines)
+
+
+def test_shard_lines_edge_cases():
+    assert shard_lines([], 4) == []
+    lines = make_lines({"a": 2})
+    # 进程数多于线路数时不产生空分片
+    assert sorted(len(shard) for shard in shard_lines(lines, 8)) == [1, 1]
+    assert shard_lines(lines, 0) == [lines]
+
+
+def test_line_snapshot_store_round_trip(tmp_path):
+    store = LineSnapshotStore(str(tmp_path))
+    stations = StationTable([{"order": 1, "sn": "A", "distanceToSp": 0}, {"order": 2, "sn": "B", "distanceToSp": 300}])
+    detail = LineDetail("short", "desc", "assist", stations,
+                        [Bus("a", 1, 100, 0, 0, "", 1700000000000, 60)], fetched_at=time.time())
+    store.write("line_1_2", detail)
+
+    loaded = store.read("line_1_2", max_age=30)
+    assert loaded.to_snapshot() == detail.to_snapshot()
+    assert loaded.stations.distance(1, 2) == 300
+    assert [f.name for f in tmp_path.iterdir()] == ["line_1_2.json"]
+    assert store.read("line_1_2", max_age=-1) is None
+    assert store.read("missing", max_age=30) is None
+
+
+def test_line_snapshot_store_ignores_partial_files(tmp_path):
+    store = LineSnapshotStore(str(tmp_path))
+    (tmp_path / "line_1_2.json").write_bytes(b'{"short_desc": ')
+    assert store.read("line_1_2", max_age=30) is None
@@ -0,0 +1,140 @@
+import asyncio
+import time
+from datetime import date
+
+from core import query
+from core.analytics import ArrivalAnalytics
+from core.api import Bus, LineDetail, StationTable
+from core.query import BusQuery, LineInfo, line_real_key
+from core.ranking import LineEntry
+
+STATIONS = StationTable([{"order": order, "sn": f"S{order}", "distanceToSp": 100} for order in range(1, 6)])
+
+
+def make_entry(line: LineInfo, optimistic_times) -> LineEntry:
+    fetched_at = time.time()
+    buses = [Bus(f"{line.line_id}-{i}", 2, 50, 0, 0, "", 1700000000000, seconds)
+             for i, seconds in enumerate(optimistic_times)]
+    detail = LineDetail("", "", "", STATIONS, buses, fetched_at=fetched_at)
+    return LineEntry(line, detail, "S5", [(fetched_at + bus.optimistic_time, bus, 250) for bus in buses])
+
+
+class BrokenLineQuery(BusQuery):
+    """渲染 broken 线路时出错"""
+
+    def __init__(self, lines, broken: str):
+        super().__init__()
+        self.lines = lines
+        self.broken = broken
+
+    async def _refresh_lines(self):
+        return {line_real_key(line) for line in self.lines}
+
+    def _render_line(self, entry, interpolate=True):
+        if entry.line.line_id == self.broken:
+            raise ValueError("bad data")
+        return super()._render_line(entry, interpolate)
+
+
+def setup_lines():
+    good = LineInfo("good", "1路", 4, "s4", "S4", city_id="a")
+    broken = LineInfo("broken", "2路", 4, "s4", "S4", city_id="a")
+    query.arrival_ranking.update(line_real_key(good), make_entry(good, [300, 900]))
+    query.arrival_ranking.update(line_real_key(broken), make_entry(broken, [60]))
+    return good, broken
+
+
+def test_render_failure_skips_only_that_line():
+    good, broken = setup_lines()
+    bus_query = BrokenLineQuery([good, broken], broken="broken")
+
+    results = asyncio.run(bus_query.async_query())
+    assert [line["line_id"] for line in results] == ["good"]
+
+    arrivals = asyncio.run(bus_query.async_query_next_arrivals(2))
+    assert [bus["bus_id"] for bus in arrivals] == ["good-0", "good-1"]
+
+
+class SlowTimetableQuery(BusQuery):
+    """上游线路数据依次返回 responses，时间表请求需要等待 timetable_ready"""
+
+    def __init__(self, responses):
+        super().__init__(record_arrivals=True)
+        self.responses = iter(responses)
+        self.timetable_ready = asyncio.Event()
+        self.api.async_get_line_detail = self._line_detail
+
+    async def _line_detail(self, **kwargs):
+        return next(self.responses)
+
+    async def get_dep_time(self, line_id, city_id=None, station_id=None):
+        await self.timetable_ready.wait()
+        return None
+
+
+def line_data(bus_ids):
+    return {
+        "line": {},
+        "stations": [{"order": order, "sn": f"S{order}", "distanceToSp": 100} for order in range(1, 6)],
+        "buses": [{"busId": bus_id, "order": 4, "delay": 0, "delayDesc": "", "travels": []} for bus_id in bus_ids],
+    }
+
+
+def test_arrivals_are_recorded_in_background(tmp_path, monkeypatch):
+    monkeypatch.setattr(query, "arrival_analytics", ArrivalAnalytics(str(tmp_path)))
+    line = LineInfo("record", "3路", 4, "s4", "S4", city_id="a")
+    bus_query = SlowTimetableQuery([line_data(["a"]), line_data([])])
+
+    async def run():
+        await bus_query.refresh_line_data(line)
+        # a 离开，检测到到站，但刷新不等待时间表和写文件
+        detail = await asyncio.wait_for(bus_query.refresh_line_data(line), timeout=1)
+        assert detail is not None and detail.buses == []
+        assert len(query.arrival_record_tasks) == 1
+        bus_query.timetable_ready.set()
+        await asyncio.gather(*query.arrival_record_tasks)
+        return await query.arrival_analytics.days(line_real_key(line))
+
+    assert asyncio.run(run()) == [date.today().isoformat()]
+    assert not query.arrival_record_tasks
+
+
+def test_line_real_key_includes_city():
+    default_city = query.config.get("location", "cityId")
+    keys = {
+        line_real_key(LineInfo("1", "1路", 4, "s4", "S4", city_id="a")),
+        line_real_key(LineInfo("1", "1路", 4, "s4", "S4", city_id="b")),
+        line_real_key(LineInfo("1", "1路", 5, "s5", "S5", city_id="a")),
+    }
+    assert len(keys) == 3
+    # 未配置城市的线路与轮询进程补全默认城市后的线路使用同一个键
+    assert (line_real_key(LineInfo("1", "1路", 4, "s4", "S4"))
+            == line_real_key(LineInfo("1", "1路", 4, "s4", "S4", city_id=default_city)))
+
+
+class FocusLineQuery(BusQuery):
+    """关注线路配置由 focus_lines 提供"""
+
+    def __init__(self):
+        super().__init__()
+        self.focus_lines = []
+
+    def _get_target_station_info(self):
+        return self.focus_lines, "S4"
+
+    async def _fetch_line_details(self, lines):
+        return [{
+            "line": {"lineId": line["line_id"], "name": line["line_id"]},
+            "stations": [{"order": order, "sn": f"S{order}", "sId": f"s{order}"} for order in range(1, 6)],
+        } for line in lines]
+
+
+def test_lines_with_order_follow_config_changes():
+    bus_query = FocusLineQuery()
+    bus_query.focus_lines = [{"line_id": "focus"}]
+    [line] = asyncio.run(bus_query.get_lines_with_order())
+    assert (line.target_station_name, line.city_id) == ("S4", None)
+
+    bus_query.focus_lines = [{"line_id": "focus", "station": "S2", "city_id": "b"}]
+    [line] = asyncio.run(bus_query.get_lines_with_order())
+    assert (line.target_station_name, line.city_id) == ("S2", "b")
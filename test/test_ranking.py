@@ -0,0 +1,78 @@
+import time
+from types import SimpleNamespace
+
+from core.api import Bus, LineDetail
+from core.ranking import ArrivalRanking, LineEntry
+
+
+def make_entry(line_id: str, fetched_at: float, optimistic_times) -> LineEntry:
+    """optimistic_times: {bus_id: 预计到站秒数}"""
+    buses = [Bus(bus_id, 1, 0, 0, 0, "", 0, seconds) for bus_id, seconds in optimistic_times.items()]
+    detail = LineDetail("", "", "", None, buses, fetched_at=fetched_at)
+    return LineEntry(SimpleNamespace(line_id=line_id), detail, "next",
+                     [(fetched_at + bus.optimistic_time, bus, 100) for bus in buses])
+
+
+def top_ids(ranking: ArrivalRanking, limit: int, keys):
+    return [(entry.line.line_id, bus_id) for entry, bus_id in ranking.top(limit, keys)]
+
+
+def test_entry_sorts_buses_by_arrival():
+    entry = make_entry("a", 1000, {"late": 300, "early": 60})
+    assert [bus.bus_id for _, bus, _ in entry.buses] == ["early", "late"]
+    assert entry.first_arrival == 1060
+    assert make_entry("b", 1000, {}).first_arrival == float("inf")
+
+
+def test_ordered_lines_and_top():
+    now = time.time()
+    ranking = ArrivalRanking()
+    ranking.update("a", make_entry("a", now, {"a1": 300, "a2": 900}))
+    ranking.update("b", make_entry("b", now, {"b1": 120}))
+    ranking.update("c", make_entry("c", now, {}))
+
+    keys = {"a", "b", "c"}
+    # 没有车辆的线路排在最后
+    assert [e.line.line_id for e in ranking.ordered_lines(keys)] == ["b", "a", "c"]
+    assert top_ids(ranking, 10, keys) == [("b", "b1"), ("a", "a1"), ("a", "a2")]
+    assert top_ids(ranking, 2, keys) == [("b", "b1"), ("a", "a1")]
+    # 只返回指定的线路
+    assert [e.line.line_id for e in ranking.ordered_lines({"a"})] == ["a"]
+    assert top_ids(ranking, 10, {"a"}) == [("a", "a1"), ("a", "a2")]
+
+
+def test_refresh_replaces_line():
+    now = time.time()
+    ranking = ArrivalRanking()
+    ranking.update("a", make_entry("a", now, {"a1": 60, "a2": 600}))
+    ranking.update("b", make_entry("b", now, {"b1": 300}))
+
+    # a1 已到站离开，a2 变为首辆车，排到 b 之后
+    refreshed = make_entry("a", now + 10, {"a2": 580})
+    ranking.update("a", refreshed)
+
+    keys = {"a", "b"}
+    assert ranking.get("a") is refreshed
+    assert [e.line.line_id for e in ranking.ordered_lines(keys)] == ["b", "a"]
+    assert top_ids(ranking, 10, keys) == [("b", "b1"), ("a", "a2")]
+    assert len(ranking._lines) == 2
+    assert len(ranking._arrivals) == 2
+
+
+def test_stale_lines_are_discarded():
+    now = time.time()
+    ranking = ArrivalRanking(stale_after=600)
+    ranking.update("old", make_entry("old", now - 601, {"o1": 10}))
+    ranking.update("new", make_entry("new", now, {"n1": 10}))
+
+    assert ranking.get("old") is None
+    assert [e.line.line_id for e in ranking.ordered_lines({"old", "new"})] == ["new"]
+    assert top_ids(ranking, 10, {"old", "new"}) == [("new", "n1")]
+    assert ranking._lines == [(now + 10, "new")]
+    assert ranking._arrivals == [(now + 10, "new", "n1")]
+
+
+def test_discard_unknown_line_is_noop():
+    ranking = ArrivalRanking()
+    ranking._discard("missing")
+    assert ranking.ordered_lines({"missing"}) == []
@@ -0,0 +1,87 @@
+from core.snapshot import RealtimeSnapshots
+
+
+def make_line(line_id: str, buses, desc: str = "desc"):
+    """buses: {bus_id: 剩余距离}"""
+    return {
+        "line_id": line_id,
+        "line_name": f"{line_id}路",
+        "line_desc": desc,
+        "observed_at": 1000.0,
+        "realtime_bus_info": [
+            {"bus_id": bus_id, "distance_to_target": distance} for bus_id, distance in buses.items()
+        ],
+    }
+
+
+def test_unchanged_results_keep_version():
+    snapshots = RealtimeSnapshots()
+    version = snapshots.update([make_line("1", {"a": 100})])
+    assert version
+    assert snapshots.update([make_line("1", {"a": 100})]) == version
+    assert snapshots.diff(version) == {"version": version, "lines": [], "removed_line_ids": []}
+
+
+def test_diff_lists_changed_buses_and_lines():
+    snapshots = RealtimeSnapshots()
+    since = snapshots.update([make_line("1", {"a": 100, "b": 500}), make_line("2", {"c": 300})])
+    version = snapshots.update([make_line("1", {"a": 50, "d": 900}), make_line("3", {})])
+    assert version != since
+
+    delta = snapshots.diff(since)
+    assert delta["version"] == version
+    assert delta["removed_line_ids"] == ["2"]
+    line_1, line_3 = delta["lines"]
+    assert line_1["line_id"] == "1"
+    assert line_1["updated_bus_info"] == [
+        {"bus_id": "a", "distance_to_target": 50},
+        {"bus_id": "d", "distance_to_target": 900},
+    ]
+    assert line_1["removed_bus_ids"] == ["b"]
+    assert "realtime_bus_info" not in line_1
+    assert line_3["line_id"] == "3"
+    assert line_3["updated_bus_info"] == []
+
+
+def test_diff_includes_line_metadata_changes():
+    snapshots = RealtimeSnapshots()
+    since = snapshots.update([make_line("1", {"a": 100})])
+    snapshots.update([make_line("1", {"a": 100}, desc="changed")])
+    [line] = snapshots.diff(since)["lines"]
+    assert line["line_desc"] == "changed"
+    assert line["updated_bus_info"] == []
+    assert line["removed_bus_ids"] == []
+
+
+def test_unknown_or_expired_version_falls_back():
+    snapshots = RealtimeSnapshots(max_history=2)
+    assert snapshots.diff("") is None
+    first = snapshots.update([make_line("1", {"a": 100})])
+    snapshots.update([make_line("1", {"a": 90})])
+    snapshots.update([make_line("1", {"a": 80})])
+    assert snapshots.diff(first) is None
+    assert snapshots.diff("unknown") is None
+
+
+def test_versions_are_shared_across_processes():
+    results = [make_line("1", {"a": 100})]
+    worker_a, worker_b = RealtimeSnapshots(), RealtimeSnapshots()
+    version = worker_a.update(results)
+    # 另一个进程的数据相同时版本号相同，可以计算增量
+    assert worker_b.update(results) == version
+    assert worker_b.diff(version)["lines"] == []
+
+    # 数据不同的进程不认识该版本号，返回全量数据
+    worker_c = RealtimeSnapshots()
+    worker_c.update([make_line("1", {"a": 90})])
+    assert worker_c.diff(version) is None
+
+
+def test_reverted_content_becomes_latest():
+    snapshots = RealtimeSnapshots(max_history=2)
+    first = snapshots.update([make_line("1", {"a": 100})])
+    second = snapshots.update([make_line("1", {"a": 90})])
+    assert snapshots.update([make_line("1", {"a": 100})]) == first
+    assert snapshots.version == first
+    assert snapshots.diff(second)["lines"][0]["updated_bus_info"] == [{"bus_id": "a", "distance_to_target": 100}]
+
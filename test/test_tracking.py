@@ -0,0 +1,52 @@
+import pytest
+
+from core.tracking import BusTracker
+
+
+def test_first_observation_has_no_speed():
+    tracker = BusTracker()
+    assert tracker.observe("bus", 100, 1000) is None
+    # 没有速度时只倒数到站时间，距离保持不变
+    assert tracker.estimate("bus", 100, 1000, 120, now=110) == (1000, 110, True)
+
+
+def test_speed_is_smoothed():
+    tracker = BusTracker(smoothing=0.5)
+    tracker.observe("bus", 0, 1000)
+    assert tracker.observe("bus", 10, 900) == 10
+    assert tracker.observe("bus", 20, 700) == pytest.approx(15)
+    # 重复的观测不改变速度
+    assert tracker.observe("bus", 20, 700) == pytest.approx(15)
+
+
+def test_estimate_extrapolates_from_last_observation():
+    tracker = BusTracker(max_extrapolation=60)
+    tracker.observe("bus", 0, 1000)
+    assert tracker.estimate("bus", 10, 900, 90, now=10) == (900, 90, False)
+    assert tracker.estimate("bus", 10, 900, 90, now=15) == (850, 85, True)
+    # 超过 max_extrapolation 后不再继续推算，且不会小于 0
+    assert tracker.estimate("bus", 10, 900, 90, now=1000) == (300, 30, True)
+    assert tracker.estimate("bus", 10, 100, 20, now=70) == (0, 0, True)
+
+
+def test_speed_is_capped_and_backwards_moves_ignored():
+    tracker = BusTracker(max_speed=25, smoothing=1)
+    tracker.observe("bus", 0, 1000)
+    assert tracker.observe("bus", 1, 0) == 25
+    # 距离变大时保留原有速度
+    assert tracker.observe("bus", 2, 500) == 25
+
+
+def test_arrived_bus_is_not_extrapolated():
+    tracker = BusTracker()
+    tracker.observe("bus", 0, 100)
+    tracker.observe("bus", 10, 50)
+    # optimistic_time 为 0 表示已到站或没有预计时间
+    assert tracker.estimate("bus", 10, 50, 0, now=12)[1] == 0
+
+
+def test_tracks_are_independent():
+    tracker = BusTracker()
+    tracker.observe("a", 0, 1000)
+    tracker.observe("a", 10, 900)
+    assert tracker.observe("b", 10, 900) is None